@@ -1,11 +1,102 @@
 import os
+import json
+import time
+import hashlib
+import logging
 import jinja2
 
+try:
+    import instrument
+except ImportError:
+    # compile_templates.py runs without the App Engine SDK
+    instrument = None
+
 template_dir = os.path.join(os.path.dirname(__file__), 'templates')
-jinja_env = jinja2.Environment(loader=jinja2.FileSystemLoader(template_dir),
-                               autoescape=True)
+
+# templates precompiled into python modules by compile_templates.py
+compiled_dir = os.path.join(os.path.dirname(__file__), 'templates_compiled')
+
+# hashes of the template files the modules were compiled from
+manifest_path = os.path.join(compiled_dir, 'sources.json')
+
+
+def template_names():
+    return sorted(name for name in os.listdir(template_dir)
+                  if not name.startswith('.'))
+
+
+def source_hashes():
+    """
+        Returns the {name: md5} of every template file. Hashes are
+        compared instead of modification times, which a deploy does
+        not keep.
+    """
+    hashes = {}
+    for name in template_names():
+        with open(os.path.join(template_dir, name), 'rb') as f:
+            hashes[name] = hashlib.md5(f.read()).hexdigest()
+    return hashes
+
+
+def stale_templates():
+    """
+        Returns the names of the templates changed, added or removed
+        since compile_templates.py last ran.
+    """
+    try:
+        with open(manifest_path) as f:
+            compiled = json.load(f)
+    except (IOError, ValueError):
+        compiled = {}
+    current = source_hashes()
+    return sorted(name for name in set(compiled) | set(current)
+                  if compiled.get(name) != current.get(name))
+
+
+def make_loader():
+    """
+        Loads templates from the precompiled modules when they exist
+        and match the template files, and from the files otherwise.
+        The dev server always reads the files, so template edits show
+        up at once.
+    """
+    loader = jinja2.FileSystemLoader(template_dir)
+    dev_server = os.environ.get('SERVER_SOFTWARE', '').startswith('Dev')
+    if os.path.isdir(compiled_dir) and not dev_server:
+        stale = stale_templates()
+        if stale:
+            logging.error('Compiled templates are out of date (%s), reading '
+                          'the template files instead; run '
+                          'compile_templates.py before deploying',
+                          ', '.join(stale))
+        else:
+            loader = jinja2.ChoiceLoader([jinja2.ModuleLoader(compiled_dir),
+                                          loader])
+    return loader
+
+
+def make_env(loader):
+    return jinja2.Environment(loader=loader, autoescape=True)
+
+
+jinja_env = make_env(make_loader())
 
 
 def jinja_render_str(template, **params):
+    started = time.time()
     t = jinja_env.get_template(template)
-    return t.render(params)
+    html = t.render(params)
+    if instrument:
+        instrument.add('template_ms', (time.time() - started) * 1000)
+    return html
+
+
+def warm_up():
+    """
+        Loads every template, so the first request of a new instance
+        does not pay for it. Returns the names of the loaded templates.
+    """
+    names = template_names()
+    for name in names:
+        jinja_env.get_template(name)
+    return names
@@ -0,0 +1,154 @@
+import uuid
+import logging
+
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+from user import User
+import counter
+import queries
+
+# most posts whose like counters are read in one batch
+REBUILD_BATCH_SIZE = 50
+
+# operations remembered by each UserStats, so a retried one is not
+# counted twice
+RECENT_OPS = 100
+
+# times rebuild() counts again when writes land while it counts
+REBUILD_ATTEMPTS = 3
+
+
+# UserStats Model
+class UserStats(db.Model):
+    """
+        This is a UserStats Class, which holds the totals shown on the
+        page of a user, kept current by every write instead of being
+        counted when the page is read.
+        The key name is the id of the user.
+
+        Attributes:
+            post_count (int): This is the number of posts of the user.
+            comment_count (int): This is the number of comments written.
+            likes_received (int): This is the number of likes given to
+                                  the posts of the user.
+            ops (list): This is the ids of the last RECENT_OPS updates.
+            version (int): This is the number of updates so far.
+    """
+    post_count = db.IntegerProperty(default=0)
+    comment_count = db.IntegerProperty(default=0)
+    likes_received = db.IntegerProperty(default=0)
+    ops = db.StringListProperty(indexed=False)
+    version = db.IntegerProperty(default=0)
+    last_modified = db.DateTimeProperty(auto_now=True)
+
+
+def stats_key(user_id):
+    return db.Key.from_path('UserStats', str(int(user_id)))
+
+
+def add(user_id, posts=0, comments=0, likes=0, op=None):
+    """
+        Adds the given deltas to the totals of user {user_id}, once per
+        operation id {op}: a retried write passing the same id, or the
+        task retrying this update, changes nothing the second time.
+        Contended updates are retried by a task, so the write that
+        caused them never fails because of its counters.
+    """
+    if not (posts or comments or likes):
+        return
+    op = op or uuid.uuid4().hex
+
+    def txn():
+        stats = db.get(stats_key(user_id)) or \
+            UserStats(key=stats_key(user_id))
+        if op in stats.ops:
+            return
+        stats.post_count += posts
+        stats.comment_count += comments
+        stats.likes_received += likes
+        stats.ops = (stats.ops + [op])[-RECENT_OPS:]
+        stats.version += 1
+        stats.put()
+    try:
+        db.run_in_transaction(txn)
+    except (db.TransactionFailedError, db.Timeout):
+        deferred.defer(add, user_id, posts, comments, likes, op)
+
+
+def get_async(user_id):
+    """
+        Starts reading the totals of user {user_id}.
+        Returns a function which waits for the UserStats.
+    """
+    rpc = db.get_async(stats_key(user_id))
+
+    def result():
+        return rpc.get_result() or UserStats(key=stats_key(user_id))
+    return result
+
+
+def count(user_id):
+    """
+        Counts the posts, comments and likes received of user {user_id}
+        from the stored posts, comments and like counters.
+    """
+    posts = likes = 0
+    comments = queries.count('comments_by_user', [user_id])
+    cursor = None
+    while True:
+        keys, cursor = queries.fetch('post_keys_by_user', [user_id],
+                                     REBUILD_BATCH_SIZE, cursor)
+        posts += len(keys)
+        if keys:
+            likes += sum(counter.get_counts(key.id() for key in keys)
+                         .values())
+        if len(keys) < REBUILD_BATCH_SIZE:
+            break
+    return posts, comments, likes
+
+
+def rebuild(user_id):
+    """
+        Recomputes the totals of user {user_id}, and returns them.
+        The totals are stored only if no add() landed while they were
+        counted, otherwise they are counted again.
+    """
+    user_id = int(user_id)
+    for _ in xrange(REBUILD_ATTEMPTS):
+        stats = db.get(stats_key(user_id))
+        version = stats.version if stats else 0
+        posts, comments, likes = count(user_id)
+
+        def txn():
+            stats = db.get(stats_key(user_id)) or \
+                UserStats(key=stats_key(user_id))
+            if stats.version != version:
+                return None
+            stats.post_count = posts
+            stats.comment_count = comments
+            stats.likes_received = likes
+            stats.version += 1
+            stats.put()
+            return stats
+        stats = db.run_in_transaction(txn)
+        if stats:
+            return stats
+    raise db.TransactionFailedError(
+        'Totals of user %d kept changing while being rebuilt' % user_id)
+
+
+def backfill_all(cursor=None, batch_size=50):
+    """
+        Task that rebuilds the totals of every user, one batch per task.
+    """
+    query = User.all(keys_only=True)
+    if cursor:
+        query.with_cursor(cursor)
+    keys = query.fetch(batch_size)
+    for key in keys:
+        rebuild(key.id())
+    if len(keys) == batch_size:
+        deferred.defer(backfill_all, query.cursor(), batch_size)
+    else:
+        logging.info('User stats backfill finished')
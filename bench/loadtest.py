@@ -0,0 +1,908 @@
+"""
+    Load test and benchmark suite for the blog.
+
+    Seeds the local datastore stub with users, posts, comments and likes,
+    then drives blog.app in-process with WebTest, and reports latency
+    percentiles, throughput and datastore calls per request for each
+    scenario. Needs the App Engine SDK and WebTest:
+
+        $ python bench/loadtest.py --sdk ~/google-cloud-sdk/platform/google_appengine \\
+              --posts 1000 --comments 20 --likes 5 --requests 200 \\
+              --output results/$(git rev-parse --short HEAD).json
+
+    Compare two runs:
+
+        $ python bench/loadtest.py --compare results/old.json results/new.json
+"""
+import os
+import sys
+import json
+import time
+import zlib
+import random
+import argparse
+import threading
+import collections
+import datetime
+import subprocess
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def setup_sdk(sdk_path):
+    """
+        Puts the App Engine SDK and the app on sys.path.
+    """
+    sys.path.insert(0, sdk_path)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+    # read templates from disk, like the dev server
+    os.environ.setdefault('SERVER_SOFTWARE', 'Development/bench')
+
+
+def setup_testbed():
+    """
+        Activates the datastore, memcache and task queue stubs.
+    """
+    from google.appengine.datastore import datastore_stub_util
+    from google.appengine.ext import testbed
+
+    bed = testbed.Testbed()
+    bed.activate()
+    policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+        probability=1)
+    bed.init_datastore_v3_stub(consistency_policy=policy)
+    bed.init_memcache_stub()
+    bed.init_taskqueue_stub(root_path=ROOT)
+    bed.init_app_identity_stub()
+    bed.init_urlfetch_stub()
+    bed.init_user_stub()
+    return bed
+
+
+def write_posts(user_ids, count, first=0):
+    """
+        Writes {count} posts by random users of {user_ids}, numbered
+        from {first}, in batches. Returns them.
+    """
+    from google.appengine.ext import db
+    from post import Post
+
+    posts = []
+    for start in xrange(first, first + count, 500):
+        batch = [Post(user_id=random.choice(user_ids),
+                      subject='Post %d' % i,
+                      content='Lorem ipsum dolor sit amet.\n' * 20)
+                 for i in xrange(start, min(first + count, start + 500))]
+        for post in batch:
+            post.render_content()
+        db.put(batch)
+        posts.extend(batch)
+    return posts
+
+
+def seed(users, posts, comments, likes):
+    """
+        Writes {users} users, {posts} posts, and {comments} comments
+        and {likes} likes per post, in batches.
+        Returns the ids of the users and of the posts.
+    """
+    from google.appengine.ext import db
+    from user import User
+    from comment import Comment
+    from like import Like
+    import counter
+    import search
+    import activity
+
+    user_ids = []
+    for i in xrange(users):
+        u = User.register('bench%d' % i, 'password')
+        user_ids.append(u.key().id())
+
+    all_posts = write_posts(user_ids, posts)
+
+    post_ids = []
+    for post in all_posts:
+        post_id = post.key().id()
+        post_ids.append(post_id)
+        children = [Comment(parent=post.key(), post_id=post_id,
+                            user_id=random.choice(user_ids),
+                            comment='Comment %d' % i)
+                    for i in xrange(comments)]
+        likers = random.sample(user_ids, min(likes, len(user_ids)))
+        children.extend(Like(parent=post.key(), post_id=post_id, user_id=uid)
+                        for uid in likers)
+        if children:
+            db.put(children)
+        counter.rebuild(post_id)
+        search.update([search.post_doc(post)] +
+                      [search.comment_doc(c) for c in children
+                       if isinstance(c, Comment)], [])
+    for uid in user_ids:
+        activity.rebuild(uid)
+    return user_ids, post_ids
+
+
+class Context(object):
+    """
+        This is a Context Class, which holds what the scenarios share:
+        the test app, the seeded ids and the login cookies.
+    """
+
+    def __init__(self, app, user_ids, post_ids):
+        from session import make_secure_val
+        self.app = app
+        self.user_ids = user_ids
+        self.post_ids = post_ids
+        self.cookies = dict(
+            (uid, 'user_id=%s' % make_secure_val(str(uid)))
+            for uid in user_ids)
+        # what the prepare() of a scenario left for it
+        self.prepared = None
+        # validators each simulated feed reader got on its last poll
+        self.feed_etags = {}
+        self.feed_statuses = collections.Counter()
+        self.feed_polls = 0
+        # datastore calls of the requests sent since run() reset it
+        self.rpcs = 0
+        # post id -> author id, filled by some_reader()
+        self.authors = {}
+
+    def get(self, url, uid=None, **kw):
+        headers = kw.pop('headers', {})
+        if uid:
+            headers['Cookie'] = self.cookies[uid]
+        return self.count_rpcs(self.app.get(url, headers=headers, **kw))
+
+    def post(self, url, params, uid=None, **kw):
+        headers = kw.pop('headers', {})
+        if uid:
+            headers['Cookie'] = self.cookies[uid]
+        return self.count_rpcs(self.app.post(url, params, headers=headers,
+                                             **kw))
+
+    def count_rpcs(self, response):
+        import instrument
+        # the middleware resets the counter when a request starts
+        self.rpcs += instrument.rpc_count()
+        return response
+
+    def some_user(self):
+        return random.choice(self.user_ids)
+
+    def some_reader(self, post_id):
+        """
+            Returns a user who did not write post {post_id}, since
+            authors may not like their own posts.
+        """
+        from post import Post
+        if post_id not in self.authors:
+            self.authors[post_id] = Post.by_id(post_id).user_id
+        author = self.authors[post_id]
+        return random.choice([uid for uid in self.user_ids if uid != author])
+
+    def some_post(self):
+        return random.choice(self.post_ids)
+
+    def own_post(self):
+        """
+            Returns a (post, author id) pair of an existing post.
+        """
+        from post import Post
+        while True:
+            post = Post.by_id(self.some_post())
+            if post:
+                return post, post.user_id
+
+
+def front(ctx):
+    ctx.get('/', uid=ctx.some_user())
+
+
+def front_anonymous(ctx):
+    ctx.get('/')
+
+
+def flush_caches(ctx):
+    """
+        Empties memcache and the instance caches, as after a deploy or
+        a memcache eviction.
+    """
+    from google.appengine.api import memcache
+    import cache
+    memcache.flush_all()
+    cache.local.clear()
+
+
+def front_cold(ctx):
+    """
+        The anonymous front page with every cache empty, to compare
+        with front_anonymous, served from the page cache.
+    """
+    ctx.get('/')
+
+
+front_cold.prepare = flush_caches
+
+
+def permalink(ctx):
+    ctx.get('/blog/%d' % ctx.some_post(), uid=ctx.some_user())
+
+
+def permalink_anonymous(ctx):
+    ctx.get('/blog/%d' % ctx.some_post())
+
+
+def login(ctx):
+    i = ctx.user_ids.index(ctx.some_user())
+    ctx.post('/login', {'username': 'bench%d' % i, 'password': 'password'})
+
+
+def unindex_user(ctx):
+    """
+        Drops the UserName entry of a user, who then looks like a user
+        registered before the index existed.
+    """
+    from google.appengine.ext import db
+    from user import username_key
+    ctx.prepared = ctx.user_ids.index(ctx.some_user())
+    db.delete(username_key('bench%d' % ctx.prepared))
+
+
+def login_unindexed(ctx):
+    """
+        The login of a user missing from the UserName index, found by
+        the name query, to compare with login.
+    """
+    ctx.post('/login', {'username': 'bench%d' % ctx.prepared,
+                        'password': 'password'})
+
+
+login_unindexed.prepare = unindex_user
+
+
+def like(ctx):
+    post_id = ctx.some_post()
+    ctx.post('/blog/%d' % post_id, {'like': 'update'},
+             uid=ctx.some_reader(post_id))
+
+
+def comment(ctx):
+    ctx.post('/blog/%d' % ctx.some_post(), {'comment': 'Benchmark comment'},
+             uid=ctx.some_user())
+
+
+def edit(ctx):
+    post, uid = ctx.own_post()
+    ctx.post('/blog/editpost/%d' % post.key().id(),
+             {'subject': post.subject, 'content': post.content + '.'},
+             uid=uid)
+
+
+def delete(ctx):
+    post, uid = ctx.own_post()
+    post_id = post.key().id()
+    ctx.get('/blog/deletepost/%d' % post_id, uid=uid)
+    ctx.post_ids.remove(post_id)
+
+
+def search(ctx):
+    ctx.get('/search?q=%s' % random.choice(['lorem', 'ipsum dolor',
+                                            'comment', 'post amet']))
+
+
+def user_page(ctx):
+    i = ctx.user_ids.index(ctx.some_user())
+    ctx.get('/user/bench%d' % i)
+
+
+def burst(ctx):
+    """
+        Likes and comments from many users on the same post,
+        the traffic of a post going viral.
+    """
+    post_id = ctx.post_ids[0]
+    if random.random() < 0.5:
+        ctx.post('/blog/%d' % post_id, {'like': 'update'},
+                 uid=ctx.some_reader(post_id),
+                 headers={'X-Requested-With': 'XMLHttpRequest'})
+    else:
+        ctx.post('/blog/%d' % post_id, {'comment': 'Burst comment'},
+                 uid=ctx.some_reader(post_id),
+                 headers={'X-Requested-With': 'XMLHttpRequest'})
+
+
+def burst_sync(ctx):
+    """
+        The burst with the write-behind queue turned off, the writes
+        made by the requests themselves, to compare burst against.
+    """
+    import writes
+    write_behind = writes.WRITE_BEHIND
+    writes.WRITE_BEHIND = False
+    try:
+        burst(ctx)
+    finally:
+        writes.WRITE_BEHIND = write_behind
+
+
+def comment_limited(ctx):
+    """
+        The comment scenario with the rate limiter on, at a rate no
+        user goes over, to compare with comment.
+    """
+    import ratelimit
+    enabled = ratelimit.ENABLED
+    ratelimit.ENABLED = True
+    try:
+        ctx.post('/blog/%d' % ctx.some_post(),
+                 {'comment': 'Benchmark comment'}, uid=ctx.some_user(),
+                 expect_errors=True)
+    finally:
+        ratelimit.ENABLED = enabled
+
+
+def time_requests(ctx, url, requests, uid=None):
+    """
+        Gets {url} {requests} times. Returns the latency percentiles
+        and datastore calls per request.
+    """
+    latencies = []
+    ctx.rpcs = 0
+    for _ in xrange(requests):
+        t = time.time()
+        ctx.get(url, uid=uid)
+        latencies.append((time.time() - t) * 1000)
+    return {'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'rpcs_per_request': float(ctx.rpcs) / requests}
+
+
+# pages down the front page the deep page is
+DEEP_PAGE = 50
+
+
+def front_page_scaling(ctx, sizes, requests):
+    """
+        Grows the blog to each number of posts of {sizes}, and times
+        the first front page and the page DEEP_PAGE pages down, which
+        should cost the same at every size. A signed in user skips the
+        page cache. Sizes below the posts already written are skipped.
+    """
+    import urllib
+    from post import Post
+    from blog import PAGE_SIZE
+
+    results = {}
+    for size in sizes:
+        if size < len(ctx.post_ids):
+            continue
+        posts = write_posts(ctx.user_ids, size - len(ctx.post_ids),
+                            len(ctx.post_ids))
+        ctx.post_ids.extend(post.key().id() for post in posts)
+
+        query = Post.summaries()
+        query.fetch(PAGE_SIZE * DEEP_PAGE)
+        deep = '/?cursor=%s' % urllib.quote(query.cursor())
+        uid = ctx.some_user()
+        results[str(size)] = {
+            'first_page': time_requests(ctx, '/', requests, uid),
+            'deep_page': time_requests(ctx, deep, requests, uid)}
+    return results
+
+
+def permalink_scaling(ctx, sizes, requests):
+    """
+        Adds comments to a new post up to each number of {sizes}, and
+        times its post page, which shows one page of comments and
+        should cost the same at every size.
+    """
+    from google.appengine.ext import db
+    from comment import Comment
+
+    if not sizes:
+        return {}
+    post = write_posts(ctx.user_ids, 1)[0]
+    post_id = post.key().id()
+    written = 0
+    results = {}
+    for size in sorted(sizes):
+        for start in xrange(written, size, 500):
+            db.put([Comment(parent=post.key(), post_id=post_id,
+                            user_id=random.choice(ctx.user_ids),
+                            comment='Comment %d' % i)
+                    for i in xrange(start, min(size, start + 500))])
+        written = max(written, size)
+        results[str(size)] = time_requests(ctx, '/blog/%d' % post_id,
+                                           requests, ctx.some_user())
+    return results
+
+
+def rate_limiter(checks=2000):
+    """
+        Returns the microseconds one rate limit check takes, with the
+        buckets in memcache and in the local fallback store.
+    """
+    import ratelimit
+    results = {}
+    for store, take in (('memcache', ratelimit.take_shared),
+                        ('local', ratelimit.take_local)):
+        started = time.time()
+        for i in xrange(checks):
+            take('bench:%d' % (i % 100), 20, 60, time.time())
+        results[store] = (time.time() - started) * 1e6 / checks
+    return results
+
+
+def in_threads(threads, calls, fn):
+    """
+        Calls fn(thread, call) {calls} times in each of {threads}
+        threads at once. Returns the seconds it took and the number of
+        calls which raised or returned False.
+    """
+    errors = []
+
+    def worker(thread):
+        for call in xrange(calls):
+            try:
+                ok = fn(thread, call) is not False
+            except Exception:
+                ok = False
+            if not ok:
+                errors.append(1)
+    workers = [threading.Thread(target=worker, args=(thread,))
+               for thread in xrange(threads)]
+    started = time.time()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return time.time() - started, len(errors)
+
+
+def concurrent_writers(ctx, threads=8, comments=20):
+    """
+        Returns the comments per second and failed writes of {threads}
+        users commenting at once, on one post each and all on the same
+        post, written by the requests themselves.
+
+        It also times bare transactional puts of comments, all under
+        blog_key() as before the migration and under one post root per
+        thread, without retries so a collision counts as a failure. The
+        stub runs transactions one at a time and has no limit of writes
+        per entity group: it shows collisions, not the throughput cap
+        of one entity group in production.
+    """
+    from google.appengine.ext import db
+    from post import blog_key
+    from comment import Comment
+    import writes
+    write_behind = writes.WRITE_BEHIND
+    writes.WRITE_BEHIND = False
+    results = {}
+    try:
+        for name, pick in (('distinct_posts',
+                            lambda thread: ctx.post_ids[thread %
+                                                        len(ctx.post_ids)]),
+                           ('same_post', lambda thread: ctx.post_ids[0])):
+            def write(thread, call):
+                response = ctx.post(
+                    '/blog/%d' % pick(thread),
+                    {'comment': 'Concurrent comment'},
+                    uid=ctx.user_ids[thread % len(ctx.user_ids)],
+                    expect_errors=True)
+                return response.status_int < 400
+            seconds, errors = in_threads(threads, comments, write)
+            results[name] = {'comments_per_s': threads * comments / seconds,
+                             'errors': errors}
+    finally:
+        writes.WRITE_BEHIND = write_behind
+
+    options = db.create_transaction_options(retries=0)
+    for name, parent in (('txn_blog_key', lambda thread: blog_key()),
+                         ('txn_post_roots',
+                          lambda thread: db.Key.from_path(
+                              'Post', ctx.post_ids[thread %
+                                                   len(ctx.post_ids)]))):
+        def put(thread, call):
+            comment = Comment(parent=parent(thread), post_id=0,
+                              user_id=ctx.user_ids[0],
+                              comment='Transactional comment')
+            db.run_in_transaction_options(options, comment.put)
+        seconds, errors = in_threads(threads, comments, put)
+        results[name] = {'comments_per_s': threads * comments / seconds,
+                         'errors': errors}
+    return results
+
+
+def counter_contention(threads=8, increments=25):
+    """
+        Returns the likes per second, failed transactions and lost
+        likes of {threads} users liking one post at once, with an
+        unsharded counter and with NUM_SHARDS shards.
+    """
+    from google.appengine.ext import db
+    import counter
+    num_shards = counter.NUM_SHARDS
+    results = {}
+    try:
+        for shards in (1, num_shards):
+            counter.NUM_SHARDS = shards
+            # a post id no seeded post has
+            post_id = 10 ** 9 + shards
+
+            def like(thread, call):
+                db.run_in_transaction(counter.increment, post_id)
+            seconds, errors = in_threads(threads, increments, like)
+            written = threads * increments - errors
+            results['%d_shards' % shards] = {
+                'likes_per_s': written / seconds,
+                'failed': errors,
+                'lost': written - counter.get_count(post_id)}
+    finally:
+        counter.NUM_SHARDS = num_shards
+    return results
+
+
+def drain_writes():
+    """
+        Writes every queued like and comment, the work the drain tasks
+        do after the requests. Returns the events and seconds it took.
+    """
+    import writes
+    started = time.time()
+    events = 0
+    while True:
+        drained = writes.drain()
+        events += drained
+        if not drained:
+            break
+    return {'events': events, 'seconds': time.time() - started}
+
+
+# feed readers polling, and polls between two post edits
+FEED_POLLERS = 50
+FEED_EDIT_EVERY = 100
+
+
+def feed_poll(ctx):
+    """
+        One poll of a feed reader sending the ETag of its last copy.
+        Every FEED_EDIT_EVERY polls a post is edited first, so the
+        readers have to fetch the feed again.
+    """
+    ctx.feed_polls += 1
+    if ctx.feed_polls % FEED_EDIT_EVERY == 0:
+        edit(ctx)
+    reader = (random.randrange(FEED_POLLERS),
+              random.choice(['/feed.atom', '/feed.json']))
+    headers = {}
+    if reader in ctx.feed_etags:
+        headers['If-None-Match'] = ctx.feed_etags[reader]
+    response = ctx.get(reader[1], headers=headers)
+    ctx.feed_statuses[response.status_int] += 1
+    ctx.feed_etags[reader] = response.headers['ETag']
+
+
+SCENARIOS = [front, front_anonymous, front_cold, permalink,
+             permalink_anonymous, login, login_unindexed, like, comment, edit,
+             delete, search, user_page, feed_poll, burst_sync, burst,
+             comment_limited]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * p / 100.0))]
+
+
+def run(ctx, scenario, requests):
+    """
+        Runs {scenario} {requests} times, after its prepare() function
+        when it has one. Returns its measures, the datastore calls
+        counted over every request the scenario sends.
+    """
+    latencies = []
+    rpcs = []
+    started = time.time()
+    # untimed setup run before each request of the scenario
+    prepare = getattr(scenario, 'prepare', None)
+    for _ in xrange(requests):
+        if prepare:
+            prepare(ctx)
+        ctx.rpcs = 0
+        t = time.time()
+        scenario(ctx)
+        latencies.append((time.time() - t) * 1000)
+        rpcs.append(ctx.rpcs)
+    duration = time.time() - started
+    return {'requests': requests,
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'throughput_rps': requests / duration if duration else 0,
+            'rpcs_per_request': float(sum(rpcs)) / len(rpcs)}
+
+
+def response_sizes(ctx):
+    """
+        Returns the raw and gzip compressed size in bytes of the first
+        front page and of a post page, as a browser receives them.
+    """
+    sizes = {}
+    for name, url in (('front', '/'),
+                      ('permalink', '/blog/%d' % ctx.some_post())):
+        body = ctx.get(url).body
+        # level 6 is what App Engine's frontend uses for gzip
+        gzipped = zlib.compress(body, 6)
+        sizes[name] = {'bytes': len(body), 'gzip_bytes': len(gzipped)}
+    return sizes
+
+
+def password_hashing(costs, hashes=10):
+    """
+        Returns the time of one PBKDF2 password check and the logins
+        one core can serve per second, at each iteration count of
+        {costs} and at the count calibrated on this machine.
+    """
+    import passwords
+    hasher = passwords.get_hasher('pbkdf2_sha256')
+    results = {}
+    for iterations in list(costs) + [hasher.iterations()]:
+        encoded = hasher.encode('bench', 'password', iterations=iterations)
+        started = time.time()
+        for _ in xrange(hashes):
+            hasher.verify('bench', 'password', encoded)
+        ms = (time.time() - started) * 1000 / hashes
+        results[str(iterations)] = {'ms_per_hash': ms,
+                                    'logins_per_core_s': 1000 / ms,
+                                    'calibrated':
+                                        iterations == hasher.iterations()}
+    return results
+
+
+def first_request():
+    """
+        Returns the milliseconds this new interpreter takes to import
+        the app and to answer its first and second page, the time to
+        first byte of a new instance.
+    """
+    started = time.time()
+    import webtest
+    import blog
+    import TemplateFile
+    imported = time.time()
+    app = webtest.TestApp(blog.app)
+    app.get('/signup')
+    first = time.time()
+    app.get('/login')
+    second = time.time()
+    return {'import_ms': (imported - started) * 1000,
+            'first_byte_ms': (first - started) * 1000,
+            'second_page_ms': (second - first) * 1000,
+            'compiled_templates': isinstance(TemplateFile.jinja_env.loader,
+                                             TemplateFile.jinja2.ChoiceLoader)}
+
+
+def startup(sdk):
+    """
+        Returns the first_request() measures of a new interpreter
+        reading the template files, and of one loading the compiled
+        templates when compile_templates.py has made them.
+    """
+    import TemplateFile
+    results = {}
+    for name, server in (('source', 'Development/bench'),
+                         ('compiled', 'Google App Engine/bench')):
+        if name == 'compiled' and not os.path.isdir(
+                TemplateFile.compiled_dir):
+            continue
+        env = dict(os.environ, SERVER_SOFTWARE=server)
+        output = subprocess.check_output(
+            [sys.executable, os.path.abspath(__file__), '--sdk', sdk,
+             '--first-request'], env=env)
+        results[name] = json.loads(output.splitlines()[-1])
+    return results
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT).strip()
+    except Exception:
+        return None
+
+
+def compare(old_path, new_path):
+    """
+        Prints the change of every measure between two result files.
+    """
+    old = json.load(open(old_path))
+    new = json.load(open(new_path))
+    print('%-22s %-16s %12s %12s %8s' % ('scenario', 'measure', 'old',
+                                         'new', 'change'))
+    for name, measures in sorted(new['scenarios'].items()):
+        before = old['scenarios'].get(name)
+        if not before:
+            continue
+        for measure in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps',
+                        'rpcs_per_request'):
+            a, b = before[measure], measures[measure]
+            change = (b - a) / a * 100 if a else 0
+            print('%-22s %-16s %12.2f %12.2f %+7.1f%%' % (name, measure, a,
+                                                          b, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sdk', default=os.environ.get('GAE_SDK'),
+                        help='path of the App Engine SDK (google_appengine)')
+    parser.add_argument('--users', type=int, default=20)
+    parser.add_argument('--posts', type=int, default=200)
+    parser.add_argument('--comments', type=int, default=10,
+                        help='comments per post')
+    parser.add_argument('--likes', type=int, default=5,
+                        help='likes per post')
+    parser.add_argument('--requests', type=int, default=100,
+                        help='requests per scenario')
+    parser.add_argument('--scenario', action='append',
+                        help='run only this scenario, may be repeated')
+    parser.add_argument('--hash-costs', default='10000,50000,100000,200000',
+                        help='PBKDF2 iteration counts to time, comma '
+                             'separated')
+    parser.add_argument('--front-sizes', default='',
+                        help='numbers of posts to grow the blog to, comma '
+                             'separated, timing the front page at each')
+    parser.add_argument('--comment-sizes', default='',
+                        help='numbers of comments to grow one post to, '
+                             'comma separated, timing its page at each')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--output', help='write the results to this file')
+    parser.add_argument('--compare', nargs=2, metavar=('OLD', 'NEW'),
+                        help='compare two result files and exit')
+    parser.add_argument('--first-request', action='store_true',
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.compare:
+        return compare(*args.compare)
+    if not args.sdk:
+        parser.error('--sdk or GAE_SDK is required')
+
+    random.seed(args.seed)
+    setup_sdk(args.sdk)
+    bed = setup_testbed()
+    if args.first_request:
+        # run by startup() in a new interpreter, prints only the result
+        try:
+            print(json.dumps(first_request()))
+        finally:
+            bed.deactivate()
+        return
+    try:
+        import webtest
+        import blog
+
+        t = time.time()
+        user_ids, post_ids = seed(args.users, args.posts, args.comments,
+                                  args.likes)
+        print('Seeded in %.1f s' % (time.time() - t))
+
+        # the scenarios send more requests per user than the limits
+        # allow, only comment_limited runs with the limiter
+        import ratelimit
+        ratelimit.ENABLED = False
+
+        ctx = Context(webtest.TestApp(blog.app), user_ids, post_ids)
+        results = {}
+        for scenario in SCENARIOS:
+            if args.scenario and scenario.__name__ not in args.scenario:
+                continue
+            results[scenario.__name__] = run(ctx, scenario, args.requests)
+            print('%-22s p50 %7.1f  p95 %7.1f  p99 %7.1f ms  %7.1f rps  '
+                  '%5.1f rpcs' % ((scenario.__name__,) + tuple(
+                      results[scenario.__name__][m] for m in
+                      ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps',
+                       'rpcs_per_request'))))
+
+        if ctx.feed_polls:
+            results['feed_poll']['not_modified_share'] = \
+                float(ctx.feed_statuses[304]) / ctx.feed_polls
+            print('feed_poll              %.1f%% of polls answered 304' %
+                  (results['feed_poll']['not_modified_share'] * 100))
+
+        limiter = rate_limiter()
+        for store, us in sorted(limiter.items()):
+            print('rate limit check       %7.1f us with %s buckets' %
+                  (us, store))
+
+        front_sizes = [int(size) for size in args.front_sizes.split(',')
+                       if size]
+        front_scaling = front_page_scaling(ctx, front_sizes, args.requests)
+        for size, measures in sorted(front_scaling.items(),
+                                     key=lambda item: int(item[0])):
+            print('front %-9s posts  first page p50 %7.1f ms  deep page '
+                  'p50 %7.1f ms' % (size, measures['first_page']['p50_ms'],
+                                    measures['deep_page']['p50_ms']))
+
+        comment_sizes = [int(size) for size in
+                         args.comment_sizes.split(',') if size]
+        comment_scaling = permalink_scaling(ctx, comment_sizes,
+                                            args.requests)
+        for size, measures in sorted(comment_scaling.items(),
+                                     key=lambda item: int(item[0])):
+            print('permalink %-6s comments  p50 %7.1f ms  p95 %7.1f ms  '
+                  '%5.1f rpcs' % (size, measures['p50_ms'],
+                                  measures['p95_ms'],
+                                  measures['rpcs_per_request']))
+
+        writers = concurrent_writers(ctx)
+        for name, measures in sorted(writers.items()):
+            print('writers %-14s %7.1f comments/s  %d failed' % (
+                name, measures['comments_per_s'], measures['errors']))
+
+        contention = counter_contention()
+        for name, measures in sorted(contention.items()):
+            print('counter %-14s %7.1f likes/s  %d failed  %d lost' % (
+                name, measures['likes_per_s'], measures['failed'],
+                measures['lost']))
+
+        drained = drain_writes()
+        if drained['events']:
+            print('drain                  %d queued writes in %.2f s' %
+                  (drained['events'], drained['seconds']))
+
+        sizes = response_sizes(ctx)
+        for name, size in sorted(sizes.items()):
+            print('%-22s %9d bytes  %9d gzipped' % (name, size['bytes'],
+                                                    size['gzip_bytes']))
+
+        hashing = password_hashing(int(cost) for cost in
+                                   args.hash_costs.split(',') if cost)
+        for cost, measures in sorted(hashing.items(),
+                                     key=lambda item: int(item[0])):
+            print('pbkdf2 %-15s %7.1f ms  %7.1f logins/s per core%s' % (
+                cost, measures['ms_per_hash'],
+                measures['logins_per_core_s'],
+                ' (calibrated)' if measures['calibrated'] else ''))
+
+        started = startup(args.sdk)
+        for name, measures in sorted(started.items()):
+            print('startup %-14s %7.1f ms first byte  %7.1f ms import  '
+                  '%7.1f ms second page%s' % (
+                      name, measures['first_byte_ms'], measures['import_ms'],
+                      measures['second_page_ms'],
+                      '' if measures['compiled_templates'] or
+                      name == 'source' else ' (compiled templates stale)'))
+    finally:
+        bed.deactivate()
+
+    if args.output:
+        report = {'revision': git_revision(),
+                  'date': datetime.datetime.utcnow().isoformat(),
+                  'config': dict((k, getattr(args, k)) for k in
+                                 ('users', 'posts', 'comments', 'likes',
+                                  'requests', 'seed')),
+                  'scenarios': results,
+                  'sizes': sizes,
+                  'password_hashing': hashing,
+                  'drain': drained,
+                  'startup': started,
+                  'concurrent_writers': writers,
+                  'front_page_scaling': front_scaling,
+                  'permalink_scaling': comment_scaling,
+                  'counter_contention': contention,
+                  'rate_limiter_us': limiter}
+        directory = os.path.dirname(args.output)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+        print('Results written to %s' % args.output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,35 +1,45 @@
 import re
-import hmac
+import json
+import math
+import urllib
+import hashlib
+import email.utils
 import webapp2
 import logging
 
 from google.appengine.ext import db
+from google.appengine.ext import deferred
 
-from user import User
+from user import User, prefetch_names, index_names
 from post import Post
+import migrate
+import cleanup
+import queries
+import instrument
+import search
+import activity
+import feed
+import writes
+import ratelimit
 from comment import Comment
 from like import Like
+from session import make_secure_val
 import TemplateFile
-import hash_secret
+import counter
+import cache
+import session
+import passwords
 
-# import secret for hashing fom hash_secret.py
-secret = hash_secret.secret()
 
-
-def make_secure_val(val):
-    """
-        Creates secure value using secret.
-    """
-    return '%s|%s' % (val, hmac.new(secret, val).hexdigest())
-
-
-def check_secure_val(secure_val):
+def http_date(value):
     """
-        Verifies secure value compare secret.
+        Returns the timestamp of the http date {value}, or None when it
+        is missing or malformed.
     """
-    val = secure_val.split('|')[0]
-    if secure_val == make_secure_val(val):
-        return val
+    parsed = email.utils.parsedate_tz(value) if value else None
+    if parsed is None:
+        return None
+    return email.utils.mktime_tz(parsed)
 
 
 class BlogHandler(webapp2.RequestHandler):
@@ -43,6 +53,21 @@ class BlogHandler(webapp2.RequestHandler):
         """
         self.response.out.write(*a, **kw)
 
+    def write_json(self, obj, status=200):
+        """
+            This methods writes {obj} as a JSON response.
+        """
+        self.response.set_status(status)
+        self.response.headers['Content-Type'] = 'application/json'
+        self.write(json.dumps(obj))
+
+    def wants_json(self):
+        """
+            Checks whether the request comes from XHR code expecting JSON.
+        """
+        return (self.request.headers.get('X-Requested-With') ==
+                'XMLHttpRequest' or self.request.get('format') == 'json')
+
     def render_str(self, template, **params):
         """
             This methods renders html using template.
@@ -50,8 +75,79 @@ class BlogHandler(webapp2.RequestHandler):
         params['user'] = self.user
         return TemplateFile.jinja_render_str(template, **params)
 
+    # when True, GET responses to anonymous readers are cached whole
+    page_cache = False
+
     def render(self, template, **kw):
-        self.write(self.render_str(template, **kw))
+        html = self.render_str(template, **kw)
+        if self.page_cacheable():
+            return self.write_page(self.cache_page(html))
+        self.write(html)
+
+    def cache_page(self, body, last_modified=None):
+        """
+            Stores {body} in the page cache with its validators, a strong
+            ETag and {last_modified}, now by default. Returns the page.
+        """
+        page = dict(body=body,
+                    etag='"%s"' % hashlib.md5(body.encode('utf-8'))
+                                        .hexdigest(),
+                    last_modified=last_modified or
+                    email.utils.formatdate(usegmt=True))
+        cache.set(self.page_cache_key(), page)
+        return page
+
+    def page_cacheable(self):
+        """
+            Checks whether the response may be served from the page cache.
+        """
+        return (self.page_cache and self.request.method == 'GET' and
+                not self.uid)
+
+    def page_cache_key(self):
+        """
+            Returns the page cache key of the request. It is computed
+            once, so a page invalidated while it renders is never stored
+            under the new generation.
+        """
+        if not hasattr(self, '_page_cache_key'):
+            self._page_cache_key = cache.page_key(self.request.path,
+                                                  self.request.query_string)
+        return self._page_cache_key
+
+    def serve_cached_page(self):
+        """
+            Answers the request from the page cache when possible.
+            Returns True if the response has been written.
+        """
+        if not self.page_cacheable():
+            return False
+        page = cache.get(self.page_cache_key())
+        if page is None:
+            return False
+        self.write_page(page)
+        return True
+
+    def write_page(self, page):
+        """
+            Writes a cached page with its validators,
+            or a 304 if the client copy is still current.
+        """
+        self.response.headers['ETag'] = page['etag']
+        self.response.headers['Last-Modified'] = page['last_modified']
+        if_none_match = self.request.headers.get('If-None-Match')
+        if if_none_match:
+            not_modified = page['etag'] in if_none_match or \
+                if_none_match.strip() == '*'
+        else:
+            since = http_date(self.request.headers.get('If-Modified-Since'))
+            modified = http_date(page['last_modified'])
+            not_modified = since is not None and modified is not None and \
+                modified <= since
+        if not_modified:
+            self.response.set_status(304)
+            return
+        self.write(page['body'])
 
     def set_secure_cookie(self, name, val):
         """
@@ -66,8 +162,7 @@ class BlogHandler(webapp2.RequestHandler):
         """
             Reads secure cookie to browser.
         """
-        cookie_val = self.request.cookies.get(name)
-        return cookie_val and check_secure_val(cookie_val)
+        return session.verify(self.request.cookies.get(name))
 
     def login(self, user):
         """
@@ -81,55 +176,195 @@ class BlogHandler(webapp2.RequestHandler):
         """
         self.response.headers.add_header('Set-Cookie', 'user_id=; Path=/')
 
+    def dispatch(self):
+        """
+            Runs the handler, then logs the datastore calls it made.
+        """
+        route = self.request.route
+        instrument.set_route(getattr(route, 'template', None))
+        if self.rate_limited(getattr(route, 'template', None)):
+            return
+        try:
+            webapp2.RequestHandler.dispatch(self)
+        finally:
+            logging.debug('datastore timeline of %s %s:\n%s',
+                          self.request.method, self.request.path,
+                          instrument.format_timeline())
+
+    def rate_limited(self, route):
+        """
+            Checks the rate limit of the request, keyed by user id or by
+            ip address. Returns True if a 429 has been written instead.
+        """
+        client = self.uid and 'user:%s' % self.uid or \
+            'ip:%s' % self.request.remote_addr
+        wait = ratelimit.check(route, self.request.method, client)
+        if not wait:
+            return False
+        error = 'Too many requests, please try again later.'
+        # webob does not know the 429 reason phrase
+        self.response.set_status(429, 'Too Many Requests')
+        self.response.headers['Retry-After'] = str(int(math.ceil(wait)))
+        if self.wants_json():
+            self.response.headers['Content-Type'] = 'application/json'
+            self.write(json.dumps({'error': error}))
+        else:
+            self.write(error)
+        return True
+
     def initialize(self, *a, **kw):
         """
             This methods gets executed for each page and
             verfies user login status, using oookie information.
         """
         webapp2.RequestHandler.initialize(self, *a, **kw)
-        uid = self.read_secure_cookie('user_id')
-        self.user = uid and User.by_id(int(uid))
+        self.uid = self.read_secure_cookie('user_id')
+
+    @property
+    def user(self):
+        """
+            The logged in User, loaded on first use only.
+        """
+        if not hasattr(self, '_user'):
+            self._user = self.uid and session.get_user(self.uid)
+        return self._user
+
 
+def invalidate_pages(post_id, front_page=False):
+    """
+        Drops the cached pages showing post {post_id}, and the
+        home page too when {front_page} is set.
+    """
+    cache.invalidate_page('/blog/%s' % post_id)
+    if front_page:
+        cache.invalidate_page('/')
 
-def blog_key(name='default'):
-    return db.Key.from_path('blogs', name)
+
+# number of posts shown on each page of the home page
+PAGE_SIZE = 10
 
 
 class BlogFront(BlogHandler):
+    page_cache = True
+
     def get(self):
         """
-            This renders home page with all posts, sorted by date.
+            This renders one page of posts, sorted by date.
+            The next page is reached through the datastore cursor
+            passed in the {cursor} query parameter.
         """
+        if self.serve_cached_page():
+            return
+
         deleted_post_id = self.request.get('deleted_post_id')
-        posts = greetings = Post.all().order('-created')
-        self.render('front.html', posts=posts, deleted_post_id=deleted_post_id)
+        cursor = self.request.get('cursor')
+
+        query = Post.summaries()
+        if cursor:
+            try:
+                query.with_cursor(cursor)
+            except (db.BadRequestError, db.BadValueError):
+                # ignore stale or tampered cursors, start from the top
+                query = Post.summaries()
+                cursor = None
+        posts = query.fetch(PAGE_SIZE)
+        prefetch_names(posts)
+        likes = counter.get_counts(p.key().id() for p in posts)
+        for p in posts:
+            p._likes = likes[p.key().id()]
+
+        next_cursor = None
+        if len(posts) == PAGE_SIZE:
+            next_cursor = urllib.quote(query.cursor())
+
+        self.render('front.html', posts=posts, deleted_post_id=deleted_post_id,
+                    cursor=cursor, next_cursor=next_cursor)
+
+
+# number of comments shown at once on a post page
+COMMENTS_PAGE_SIZE = 20
+
+
+def query_page_async(name, args, page_size, cursor=None):
+    """
+        Starts fetching one page of query {name} in a single batch.
+        Returns a function which waits for the results and the cursor
+        of the next page, or None on the last page. Stale or tampered
+        cursors give an empty page.
+    """
+    try:
+        fetch = queries.fetch_async(name, args, page_size, cursor)
+    except (db.BadRequestError, db.BadValueError):
+        return lambda: ([], None)
+
+    def result():
+        try:
+            results, next_cursor = fetch()
+        except (db.BadRequestError, db.BadValueError):
+            return [], None
+        if len(results) < page_size:
+            next_cursor = None
+        return results, next_cursor
+    return result
+
+
+def comment_page_async(post_id, cursor=None):
+    """
+        Starts fetching one page of the comments of post {post_id},
+        newest first.
+    """
+    return query_page_async('comments_by_post', [int(post_id)],
+                            COMMENTS_PAGE_SIZE, cursor)
+
+
+def comment_page(post_id, cursor=None):
+    """
+        Fetches one page of the comments of post {post_id}.
+    """
+    return comment_page_async(post_id, cursor)()
 
 
 class PostPage(BlogHandler):
+    page_cache = True
+
     def get(self, post_id):
         """
             This renders home post page with content, comments and likes.
         """
-        key = db.Key.from_path('Post', int(post_id), parent=blog_key())
-        post = db.get(key)
-
-        comments = db.GqlQuery("select * from Comment where post_id = " +
-                               post_id + " order by created desc")
+        if self.serve_cached_page():
+            return
 
-        likes = db.GqlQuery("select * from Like where post_id="+post_id)
+        # start the post, comments and like count reads together,
+        # so the page waits for the slowest one only
+        post = Post.by_id_async(post_id)
+        comments = comment_page_async(post_id,
+                                      self.request.get('comments_cursor'))
+        likes = counter.get_count_async(post_id)
 
+        post = post()
         if not post:
             self.error(404)
             return
 
         error = self.request.get('error')
 
-        self.render("permalink.html", post=post, noOfLikes=likes.count(),
-                    comments=comments, error=error)
+        comments, next_cursor = comments()
+        likes = likes()
+        # the reader's own likes and comments still in the write queue
+        if self.uid:
+            mine = writes.pending(self.uid, post)
+            likes += len([e for e in mine if isinstance(e, Like)])
+            if not self.request.get('comments_cursor'):
+                comments = [e for e in reversed(mine)
+                            if isinstance(e, Comment)] + comments
+        authors = prefetch_names([post] + comments)
+
+        self.render("permalink.html", post=post, noOfLikes=likes,
+                    comments=comments, next_cursor=next_cursor,
+                    error=error, authors=authors)
 
     def post(self, post_id):
-        key = db.Key.from_path('Post', int(post_id), parent=blog_key())
-        post = db.get(key)
+        post = Post.by_id(post_id)
 
         if not post:
             self.error(404)
@@ -137,46 +372,166 @@ class PostPage(BlogHandler):
 
         """
             On posting comment, new comment tuple is created and stored,
-            with relationship data of user and post.
-        """
-        c = ""
-        if(self.user):
-            # On clicking like, post-like value increases.
-            if(self.request.get('like') and
-               self.request.get('like') == "update"):
-                likes = db.GqlQuery("select * from Like where post_id = " +
-                                    post_id + " and user_id = " +
-                                    str(self.user.key().id()))
-
-                if self.user.key().id() == post.user_id:
-                    self.redirect("/blog/" + post_id +
-                                  "?error=You cannot like your " +
-                                  "post.!!")
-                    return
-                elif likes.count() == 0:
-                    l = Like(parent=blog_key(), user_id=self.user.key().id(),
-                             post_id=int(post_id))
-                    l.put()
-
-            # On commenting, it creates new comment tuple
-            if(self.request.get('comment')):
-                c = Comment(parent=blog_key(), user_id=self.user.key().id(),
-                            post_id=int(post_id),
-                            comment=self.request.get('comment'))
-                c.put()
-        else:
-            self.redirect("/login?error=You need to login before " +
-                          "performing edit, like or commenting.!!")
+            with relationship data of user and post. The browser is then
+            redirected to the post page, XHR clients get JSON instead.
+        """
+        if not self.user:
+            error = "You need to login before performing edit, like " + \
+                    "or commenting.!!"
+            if self.wants_json():
+                return self.write_json({'error': error}, status=401)
+            return self.redirect("/login?error=" + error)
+
+        result = {}
+        # On clicking like, post-like value increases.
+        if(self.request.get('like') and
+           self.request.get('like') == "update"):
+            if self.user.key().id() == post.user_id:
+                error = "You cannot like your post.!!"
+                if self.wants_json():
+                    return self.write_json({'error': error}, status=403)
+                return self.redirect("/blog/" + post_id + "?error=" + error)
+            # the like is queued, see writes.py, and shown as pending
+            # until it is written
+            uid = self.user.key().id()
+            pending_like = any(isinstance(e, Like)
+                               for e in writes.pending(uid, post))
+            if not pending_like and \
+                    not db.get(Like.make_key(post.key(), uid)):
+                writes.submit(writes.like_event(post, uid))
+                pending_like = writes.WRITE_BEHIND
+            result['likes'] = counter.get_count(post_id) + int(pending_like)
+
+        # On commenting, it creates new comment tuple
+        if(self.request.get('comment')):
+            event = writes.comment_event(post, self.user.key().id(),
+                                         self.request.get('comment'))
+            writes.submit(event)
+            c = writes.to_entity(event)
+            c._pending = writes.WRITE_BEHIND
+            result['html'] = self.render_str(
+                'comment.html', c=c, post_id=post_id,
+                authors={c.user_id: self.user.name})
+
+        if self.wants_json():
+            return self.write_json(result)
+        self.redirect("/blog/" + post_id)
+
+
+class CommentsPage(BlogHandler):
+    def get(self, post_id):
+        """
+            Returns the next page of comments of a post as JSON,
+            for the "load more" button of the post page.
+        """
+        comments, next_cursor = comment_page(post_id,
+                                             self.request.get('cursor'))
+        authors = prefetch_names(comments)
+        html = ''.join(self.render_str('comment.html', c=c,
+                                       post_id=post_id, authors=authors)
+                       for c in comments)
+        self.write_json({'html': html, 'next_cursor': next_cursor})
+
+
+class Feed(BlogHandler):
+    def page_cacheable(self):
+        # feeds look the same to every reader
+        return True
+
+    def page_cache_key(self):
+        """
+            Caches the feed per host, whatever the query string,
+            so pollers adding cache busters still share it.
+        """
+        if not hasattr(self, '_page_cache_key'):
+            self._page_cache_key = cache.page_key(self.request.path,
+                                                  self.request.host)
+        return self._page_cache_key
+
+    def get(self):
+        """
+            Serves the Atom or JSON feed of the newest posts. The feed
+            is generated again only after a post was created, edited
+            or deleted, and pollers holding the current copy get a 304.
+            Its Last-Modified is the time it was generated, since a
+            deleted post changes the feed but no remaining post.
+        """
+        self.response.headers['Content-Type'] = feed.FEEDS[self.request.path]
+        if self.serve_cached_page():
             return
+        posts = feed.latest_posts()
+        body = feed.render(self.request.path, posts, self.request.host_url)
+        self.write_page(self.cache_page(body))
+
 
-        comments = db.GqlQuery("select * from Comment where post_id = " +
-                               post_id + "order by created desc")
+# number of posts and of comments shown at once on a user page
+USER_PAGE_SIZE = 10
+
+
+class UserPage(BlogHandler):
+    def get(self, name):
+        """
+            This renders the posts and comments of user {name}, newest
+            first, with the user's totals. Both lists page through
+            their own cursor, {posts_cursor} and {comments_cursor}.
+        """
+        author = User.by_name(name)
+        if not author:
+            self.error(404)
+            return
+        uid = author.key().id()
+
+        posts_cursor = self.request.get('posts_cursor')
+        comments_cursor = self.request.get('comments_cursor')
+        posts = query_page_async('posts_by_user', [uid], USER_PAGE_SIZE,
+                                 posts_cursor)
+        comments = query_page_async('comments_by_user', [uid],
+                                    USER_PAGE_SIZE, comments_cursor)
+        stats = activity.get_async(uid)
+
+        posts, next_posts_cursor = posts()
+        comments, next_comments_cursor = comments()
+        likes = counter.get_counts(p.key().id() for p in posts)
+        for p in posts:
+            p._user_name = author.name
+            p._likes = likes[p.key().id()]
+        commented = Post.by_ids(c.post_id for c in comments)
+
+        self.render('user.html', author=author, stats=stats(), posts=posts,
+                    comments=comments, commented=commented,
+                    posts_cursor=posts_cursor,
+                    comments_cursor=comments_cursor,
+                    next_posts_cursor=next_posts_cursor and
+                    urllib.quote(next_posts_cursor),
+                    next_comments_cursor=next_comments_cursor and
+                    urllib.quote(next_comments_cursor))
+
+
+# number of results shown on each search page
+SEARCH_PAGE_SIZE = 10
+
+
+class Search(BlogHandler):
+    def get(self):
+        """
+            This renders the posts and comments matching the {q}
+            parameter, best match first.
+        """
+        q = self.request.get('q')
+        try:
+            page = max(1, int(self.request.get('page', 1)))
+        except ValueError:
+            page = 1
 
-        likes = db.GqlQuery("select * from Like where post_id="+post_id)
+        total, results = search.search(q, (page - 1) * SEARCH_PAGE_SIZE,
+                                       SEARCH_PAGE_SIZE)
+        posts = Post.by_ids(r.post_id for r in results)
+        results = [r for r in results if r.post_id in posts]
+        pages = (total + SEARCH_PAGE_SIZE - 1) // SEARCH_PAGE_SIZE
 
-        self.render("permalink.html", post=post,
-                    comments=comments, noOfLikes=likes.count(),
-                    new=c)
+        self.render('search.html', q=q, results=results, posts=posts,
+                    total=total, page=page, pages=pages,
+                    q_url=urllib.quote_plus(q.encode('utf-8')))
 
 
 class NewPost(BlogHandler):
@@ -197,9 +552,14 @@ class NewPost(BlogHandler):
         content = self.request.get('content')
 
         if subject and content:
-            p = Post(parent=blog_key(), user_id=self.user.key().id(),
+            p = Post(user_id=self.user.key().id(),
                      subject=subject, content=content)
+            p.render_content()
             p.put()
+            activity.add(p.user_id, posts=1, op='post:%d' % p.key().id())
+            invalidate_pages(p.key().id(), front_page=True)
+            feed.invalidate()
+            search.index_post(p)
             self.redirect('/blog/%s' % str(p.key().id()))
         else:
             error = "subject and content, please!"
@@ -210,21 +570,19 @@ class NewPost(BlogHandler):
 class DeletePost(BlogHandler):
     def get(self, post_id):
         if self.user:
-            key = db.Key.from_path('Post', int(post_id), parent=blog_key())
-            post = db.get(key)
+            post = Post.by_id(post_id)
             # check if the post exist in the database
             if not post:
                 # if post does not exist, redirect to login page
                 return self.redirect('/login')
 
             if post.user_id == self.user.key().id():
-                post.delete()
-
-                # delete all the comments associated with that post
-                comments = Comment.all()
-                comments.filter("post_id", int(post_id))
-                for comment in comments:
-                    comment.delete()
+                post.uncache()
+                # delete the post with its comments and likes
+                cleanup.delete_post(post)
+                invalidate_pages(post_id, front_page=True)
+                feed.invalidate()
+                search.remove_post(post_id)
 
                 self.redirect("/?deleted_post_id="+post_id)
             else:
@@ -238,8 +596,7 @@ class DeletePost(BlogHandler):
 class EditPost(BlogHandler):
     def get(self, post_id):
         if self.user:
-            key = db.Key.from_path('Post', int(post_id), parent=blog_key())
-            post = db.get(key)
+            post = Post.by_id(post_id)
             if not post:
                 # if post does not exist, redirect to login page
                 return self.redirect('/login')
@@ -265,10 +622,7 @@ class EditPost(BlogHandler):
 
         if self.user:
             if subject and content:
-                    key = db.Key.from_path('Post',
-                                           int(post_id),
-                                           parent=blog_key())
-                    post = db.get(key)
+                    post = Post.by_id(post_id)
                     # make sure the post exist
                     if not post:
                         # if post does not exist, redirect to login page
@@ -277,9 +631,14 @@ class EditPost(BlogHandler):
                     if self.user.key().id() != post.user_id:
                         # handle case
                         return self.redirect('/login')
+                    post.uncache()
                     post.subject = subject
                     post.content = content
+                    post.render_content()
                     post.put()
+                    invalidate_pages(post_id, front_page=True)
+                    feed.invalidate()
+                    search.index_post(post)
                     return self.redirect('/blog/%s' % post_id)
             else:
                 error = "subject and content, please!"
@@ -293,14 +652,16 @@ class DeleteComment(BlogHandler):
 
     def get(self, post_id, comment_id):
         if self.user:
-            key = db.Key.from_path('Comment', int(comment_id),
-                                   parent=blog_key())
-            c = db.get(key)
+            c = Comment.by_id(post_id, comment_id)
             if not c:
                 # if post does not exist, redirect to login page
                 return self.redirect('/login')
             if c.user_id == self.user.key().id():
                 c.delete()
+                activity.add(c.user_id, comments=-1,
+                             op='delete-comment:%s' % c.key())
+                invalidate_pages(post_id)
+                search.remove_comment(post_id, comment_id)
                 return self.redirect("/blog/"+post_id+"?deleted_comment_id=" +
                                      comment_id)
             else:
@@ -315,10 +676,7 @@ class DeleteComment(BlogHandler):
 class EditComment(BlogHandler):
     def get(self, post_id, comment_id):
         if self.user:
-            key = db.Key.from_path('Comment',
-                                   int(comment_id),
-                                   parent=blog_key())
-            c = db.get(key)
+            c = Comment.by_id(post_id, comment_id)
             if not c:
                 return self.redirect('/login')
             if c.user_id == self.user.key().id():
@@ -346,15 +704,14 @@ class EditComment(BlogHandler):
         # make sure the user owns the post
         if self.user:
             if comment:
-                key = db.Key.from_path('Comment',
-                                       int(comment_id),
-                                       parent=blog_key())
-                c = db.get(key)
+                c = Comment.by_id(post_id, comment_id)
                 if c and self.user.key().id() != c.user_id:
                     # handle case
                     return self.redirect('/login')
                 c.comment = comment
                 c.put()
+                invalidate_pages(post_id)
+                search.index_comment(c)
                 self.redirect('/blog/%s' % post_id)
             else:
                 error = "subject and content, please!"
@@ -432,7 +789,10 @@ class Register(Signup):
             self.render('signup-form.html', error_username=msg)
         else:
             u = User.register(self.username, self.password, self.email)
-            u.put()
+            if not u:
+                msg = 'That user already exists please choose different ' \
+                      'username.'
+                return self.render('signup-form.html', error_username=msg)
 
             self.login(u)
             self.redirect('/')
@@ -451,6 +811,9 @@ class Login(BlogHandler):
 
         u = User.login(username, password)
         if u:
+            if getattr(u, '_rehashed', False):
+                # cached copies still hold the old hash
+                session.forget_user(u.key().id())
             self.login(u)
             self.redirect('/')
         else:
@@ -464,10 +827,121 @@ class Logout(BlogHandler):
         self.redirect('/')
 
 
-app = webapp2.WSGIApplication([
+class Warmup(BlogHandler):
+    def get(self):
+        """
+            Called by App Engine when a new instance starts,
+            before it receives traffic.
+        """
+        TemplateFile.warm_up()
+        # calibrate the password hash cost before the first login
+        passwords.get_hasher().iterations()
+        self.write('Warm.')
+
+
+class MigrateUserNames(BlogHandler):
+    def get(self):
+        """
+            Starts the task which indexes the names of existing users.
+            Admin only, see app.yaml.
+        """
+        deferred.defer(index_names)
+        self.write('UserName index migration started.')
+
+
+class MigrateEntityGroups(BlogHandler):
+    def get(self):
+        """
+            Starts the task which moves posts out of the blog_key()
+            entity group. Admin only, see app.yaml.
+        """
+        deferred.defer(migrate.migrate_posts)
+        self.write('Entity group migration started.')
+
+
+class RerenderPosts(BlogHandler):
+    def get(self):
+        """
+            Starts the task which stores the html of posts rendered by
+            an older markup version. Admin only, see app.yaml.
+        """
+        deferred.defer(migrate.rerender_posts)
+        self.write('Post rendering started.')
+
+
+class RebuildSearchIndex(BlogHandler):
+    def get(self):
+        """
+            Starts the tasks which drop the search index and build it
+            again from every post and comment. Admin only, see app.yaml.
+        """
+        deferred.defer(search.clear, _queue=search.QUEUE)
+        self.write('Search index rebuild started.')
+
+
+class CollectGarbage(BlogHandler):
+    def get(self):
+        """
+            Starts the tasks which remove comments and likes left
+            behind by deleted posts. Admin only, see app.yaml.
+        """
+        cleanup.collect_garbage()
+        self.write('Orphan collection started.')
+
+
+class RequestStats(BlogHandler):
+    def get(self):
+        """
+            Shows the latency, template, datastore and cache histograms
+            of each route on this instance. Admin only, see app.yaml.
+        """
+        stats = instrument.stats()
+        if self.wants_json():
+            return self.write_json(stats)
+        self.render('stats.html', stats=sorted(stats.items()))
+
+
+class CacheStats(BlogHandler):
+    def get(self):
+        """
+            Shows cache and session hit, miss and eviction counters
+            as JSON.
+            Admin only, see app.yaml.
+        """
+        stats = cache.stats()
+        stats['session'] = session.stats()
+        self.write_json(stats)
+
+
+class BackfillUserStats(BlogHandler):
+    def get(self):
+        """
+            Starts the task which recomputes the totals of every user
+            from the stored posts, comments and like counters.
+            Admin only, see app.yaml.
+        """
+        deferred.defer(activity.backfill_all)
+        self.write('User stats backfill started.')
+
+
+class BackfillLikeCounters(BlogHandler):
+    def get(self):
+        """
+            Starts the task which rebuilds every post's like counter
+            from the stored likes. Admin only, see app.yaml.
+        """
+        deferred.defer(counter.backfill_all)
+        self.write('Like counter backfill started.')
+
+
+app = instrument.StatsMiddleware(webapp2.WSGIApplication([
                                ('/?', BlogFront),
                                ('/blog/([0-9]+)', PostPage),
+                               ('/blog/([0-9]+)/comments', CommentsPage),
                                ('/blog/newpost', NewPost),
+                               ('/search', Search),
+                               (r'/feed\.(?:atom|json)', Feed),
+                               ('/user/([a-zA-Z0-9_-]+)', UserPage),
                                ('/blog/deletepost/([0-9]+)', DeletePost),
                                ('/blog/editpost/([0-9]+)', EditPost),
                                ('/blog/deletecomment/([0-9]+)/([0-9]+)',
@@ -477,5 +951,15 @@ app = webapp2.WSGIApplication([
                                ('/signup', Register),
                                ('/login', Login),
                                ('/logout', Logout),
+                               ('/_ah/warmup', Warmup),
+                               ('/admin/backfill/likes', BackfillLikeCounters),
+                               ('/admin/backfill/userstats', BackfillUserStats),
+                               ('/admin/stats', RequestStats),
+                               ('/admin/stats/cache', CacheStats),
+                               ('/admin/migrate/usernames', MigrateUserNames),
+                               ('/admin/migrate/posts', MigrateEntityGroups),
+                               ('/admin/cleanup/orphans', CollectGarbage),
+                               ('/admin/rerender/posts', RerenderPosts),
+                               ('/admin/search/rebuild', RebuildSearchIndex),
                                ],
-                              debug=True)
+                              debug=True))
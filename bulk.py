@@ -0,0 +1,458 @@
+"""
+    Exports the users, posts, comments and likes of the blog to
+    newline-delimited JSON, one file per kind, and imports such files
+    into another datastore, where every entity gets a new id and the
+    user_id and post_id references are remapped to the new ids.
+    Needs the App Engine SDK:
+
+        $ python bulk.py export dump/ --sdk ~/google-cloud-sdk/platform/google_appengine \\
+              --datastore-file ~/blog/datastore.db
+        $ python bulk.py import dump/ --sdk ... --remote my-app.appspot.com
+
+    Without --remote, the commands run against the local datastore stub,
+    reading and writing the dev server datastore given by
+    --datastore-file, or an empty in-memory one.
+
+    Rows are read and written in batches of --batch-size, so memory use
+    does not grow with the data. The progress is saved in
+    <dir>/<command>.state.json after each batch: an interrupted command
+    started again with the same arguments continues where it stopped.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import datetime
+
+# kinds in import order, references point to earlier kinds
+KINDS = ['User', 'Post', 'Comment', 'Like']
+
+DATETIME_FORMATS = ('%Y-%m-%dT%H:%M:%S.%f', '%Y-%m-%dT%H:%M:%S')
+
+
+def connect(args):
+    """
+        Puts the SDK and the app on sys.path, and connects to the remote
+        datastore, or activates the local stubs. Returns the testbed.
+    """
+    root = os.path.dirname(os.path.abspath(__file__))
+    sys.path.insert(0, args.sdk)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, root)
+
+    if args.remote:
+        from google.appengine.ext.remote_api import remote_api_stub
+        remote_api_stub.ConfigureRemoteApiForOAuth(args.remote,
+                                                   '/_ah/remote_api')
+        return None
+
+    from google.appengine.ext import testbed
+    bed = testbed.Testbed()
+    bed.activate()
+    bed.setup_env(app_id=args.app_id, overwrite=True)
+    if args.datastore_file:
+        bed.init_datastore_v3_stub(datastore_file=args.datastore_file,
+                                   use_sqlite=True)
+    else:
+        bed.init_datastore_v3_stub()
+    bed.init_memcache_stub()
+    return bed
+
+
+def get_models():
+    from google.appengine.ext import db
+    from user import User
+    from post import Post
+    from comment import Comment
+    from like import Like
+
+    # ImportMapping Model
+    class ImportMapping(db.Model):
+        """
+            This is an ImportMapping Class, which records the new id
+            given to an imported entity, so a resumed import reuses it.
+            The key name is <kind>:<exported id or key>.
+
+            Attributes:
+                new_id (int): This is the id of the imported entity.
+        """
+        new_id = db.IntegerProperty(required=True)
+
+    return dict(User=User, Post=Post, Comment=Comment, Like=Like,
+                ImportMapping=ImportMapping)
+
+
+def to_row(entity):
+    """
+        Returns the JSON-ready dict of {entity}.
+    """
+    row = {'id': entity.key().id_or_name(), 'key': str(entity.key())}
+    for name in entity.properties():
+        value = getattr(entity, name)
+        if isinstance(value, datetime.datetime):
+            value = value.isoformat()
+        row[name] = value
+    return row
+
+
+def parse_datetime(value):
+    for format in DATETIME_FORMATS:
+        try:
+            return datetime.datetime.strptime(value, format)
+        except ValueError:
+            pass
+    raise ValueError('Not a datetime: %r' % value)
+
+
+def from_row(model, row, key, **overrides):
+    """
+        Returns the unsaved {model} entity of {row} under {key}.
+    """
+    from google.appengine.ext import db
+
+    values = {}
+    for name, prop in model.properties().items():
+        value = overrides.get(name, row.get(name))
+        if value is not None and isinstance(prop, db.DateTimeProperty):
+            value = parse_datetime(value)
+        values[name] = value
+    return model(key=key, **values)
+
+
+class State(object):
+    """
+        This is a State Class, the progress of a command, saved to
+        <dir>/<command>.state.json after each batch.
+    """
+
+    def __init__(self, directory, command):
+        self.path = os.path.join(directory, '%s.state.json' % command)
+        self.kinds = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                self.kinds = json.load(f)
+
+    def kind(self, kind):
+        return self.kinds.setdefault(kind, {'offset': 0, 'rows': 0,
+                                            'skipped': 0, 'cursor': None,
+                                            'done': False})
+
+    def save(self):
+        # write a new file and rename it, a crash never leaves half a state
+        with open(self.path + '.tmp', 'w') as f:
+            json.dump(self.kinds, f, indent=2, sort_keys=True)
+        os.rename(self.path + '.tmp', self.path)
+
+
+class Meter(object):
+    """
+        This is a Meter Class, which prints the rows per second of a
+        kind after each batch.
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.rows = 0
+        self.started = time.time()
+
+    def add(self, rows, total):
+        self.rows += rows
+        print('%-8s %9d rows  %8.0f rows/s' % (self.kind, total, self.rate()))
+
+    def rate(self):
+        elapsed = time.time() - self.started
+        return self.rows / elapsed if elapsed else 0
+
+
+def export_kind(models, kind, directory, state, batch_size):
+    """
+        Appends the {kind} entities to <dir>/<kind>.ndjson, one batch at
+        a time, from the cursor saved after the last complete batch.
+    """
+    progress = state.kind(kind)
+    if progress['done']:
+        return 0
+    query = models[kind].all()
+
+    meter = Meter(kind)
+    with open(os.path.join(directory, kind + '.ndjson'), 'ab') as f:
+        # drop the rows written after the last saved batch
+        f.truncate(progress['offset'])
+        f.seek(0, os.SEEK_END)
+        while True:
+            # fetch() starts again from the cursor given to the query
+            query.with_cursor(progress['cursor'])
+            entities = query.fetch(batch_size)
+            for entity in entities:
+                f.write(json.dumps(to_row(entity)) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+            progress['cursor'] = query.cursor()
+            progress['offset'] = f.tell()
+            progress['rows'] += len(entities)
+            progress['done'] = len(entities) < batch_size
+            state.save()
+            meter.add(len(entities), progress['rows'])
+            if progress['done']:
+                return meter.rows
+
+
+def read_batch(f, batch_size):
+    rows = []
+    while len(rows) < batch_size:
+        line = f.readline()
+        if not line:
+            break
+        if line.strip():
+            rows.append(json.loads(line))
+    return rows
+
+
+class Importer(object):
+    """
+        This is an Importer Class, which turns batches of exported rows
+        into entities with new ids. The old -> new id mappings are kept
+        in the datastore, as ImportMapping entities, so memory stays
+        bounded and an interrupted import gives the same ids again.
+    """
+
+    def __init__(self, models):
+        from google.appengine.api import datastore
+        from google.appengine.ext import db
+        from migrate import copy_entity
+        self.datastore = datastore
+        self.copy_entity = copy_entity
+        self.db = db
+        self.models = models
+        self.rejected = []
+
+    def mapping_key(self, kind, old):
+        return self.db.Key.from_path('ImportMapping', '%s:%s' % (kind, old))
+
+    def lookup(self, kind, olds):
+        """
+            Returns the {old: new id} map of the {kind} ids {olds}
+            imported so far, with one batch get.
+        """
+        olds = list(set(olds))
+        mappings = self.db.get([self.mapping_key(kind, old) for old in olds])
+        return dict((old, m.new_id) for old, m in zip(olds, mappings) if m)
+
+    def new_ids(self, key, count):
+        start, _ = self.db.allocate_ids(key, count)
+        return range(start, start + count)
+
+    def assign(self, kind, olds, key):
+        """
+            Returns the {old: new id} map of {olds}, giving ids allocated
+            under the path of {key} to the ones not imported yet, and
+            the ImportMapping entities of those.
+        """
+        ids = self.lookup(kind, olds)
+        missing = [old for old in olds if old not in ids]
+        mappings = []
+        if missing:
+            for old, new_id in zip(missing, self.new_ids(key, len(missing))):
+                ids[old] = new_id
+                mappings.append(self.models['ImportMapping'](
+                    key=self.mapping_key(kind, old), new_id=new_id))
+        return ids, mappings
+
+    def import_batch(self, kind, rows):
+        """
+            Writes one batch of {kind} rows. The id mappings are written
+            before the entities, so a resumed import never gives an
+            entity a second id. Returns the number of skipped rows.
+        """
+        entities, mappings, skipped = getattr(self, 'import_' +
+                                              kind.lower())(rows)
+        if mappings:
+            self.db.put(mappings)
+        if entities:
+            # keep the exported dates, instead of stamping the import time
+            self.datastore.Put([self.copy_entity(entity, entity.key())
+                                for entity in entities])
+        return skipped
+
+    def import_user(self, rows):
+        """
+            Users whose name is already taken in the target datastore
+            are rejected, with their posts, comments and likes: they
+            are never merged into a user they may not be.
+        """
+        from user import users_key, username_key, UserName
+        db, User = self.db, self.models['User']
+
+        # a taken name belongs to another user, or to this one when
+        # the batch was written before an interruption
+        imported = self.lookup('User', [row['id'] for row in rows])
+        names = db.get([username_key(row['name']) for row in rows])
+        new_rows = []
+        for row, name in zip(rows, names):
+            if not name or imported.get(row['id']) == name.user_id:
+                new_rows.append(row)
+            else:
+                self.rejected.append(row['name'])
+
+        ids, mappings = self.assign(
+            'User', [row['id'] for row in new_rows],
+            db.Key.from_path('User', 1, parent=users_key()))
+        entities = []
+        for row in new_rows:
+            uid = ids[row['id']]
+            entities.append(from_row(User, row, db.Key.from_path(
+                'User', uid, parent=users_key())))
+            entities.append(UserName(key=username_key(row['name']),
+                                     user_id=uid))
+        return entities, mappings, len(rows) - len(new_rows)
+
+    def import_post(self, rows):
+        db, Post = self.db, self.models['Post']
+        users = self.lookup('User', [row['user_id'] for row in rows])
+        rows_ok = [row for row in rows if row['user_id'] in users]
+        ids, mappings = self.assign('Post', [row['id'] for row in rows_ok],
+                                    db.Key.from_path('Post', 1))
+        entities = [from_row(Post, row,
+                             db.Key.from_path('Post', ids[row['id']]),
+                             user_id=users[row['user_id']])
+                    for row in rows_ok]
+        return entities, mappings, len(rows) - len(rows_ok)
+
+    def references(self, rows):
+        """
+            Returns the rows whose user and post were imported,
+            with the {user: new id} and {post: new id} maps.
+        """
+        users = self.lookup('User', [row['user_id'] for row in rows])
+        posts = self.lookup('Post', [row['post_id'] for row in rows])
+        rows_ok = [row for row in rows
+                   if row['user_id'] in users and row['post_id'] in posts]
+        return rows_ok, users, posts
+
+    def import_comment(self, rows):
+        db, Comment = self.db, self.models['Comment']
+        rows_ok, users, posts = self.references(rows)
+
+        # comment ids are allocated under their new post
+        by_post = {}
+        for row in rows_ok:
+            by_post.setdefault(posts[row['post_id']], []).append(row)
+        entities, mappings = [], []
+        for post_id, post_rows in by_post.items():
+            parent = db.Key.from_path('Post', post_id)
+            ids, new_mappings = self.assign(
+                'Comment', [row['key'] for row in post_rows],
+                db.Key.from_path('Comment', 1, parent=parent))
+            mappings.extend(new_mappings)
+            entities.extend(
+                from_row(Comment, row, db.Key.from_path(
+                    'Comment', ids[row['key']], parent=parent),
+                    user_id=users[row['user_id']], post_id=post_id)
+                for row in post_rows)
+        return entities, mappings, len(rows) - len(rows_ok)
+
+    def import_like(self, rows):
+        """
+            Likes need no mapping, their key is made of the new user
+            and post ids.
+        """
+        db, Like = self.db, self.models['Like']
+        rows_ok, users, posts = self.references(rows)
+        entities = []
+        for row in rows_ok:
+            post_key = db.Key.from_path('Post', posts[row['post_id']])
+            uid = users[row['user_id']]
+            entities.append(from_row(Like, row, Like.make_key(post_key, uid),
+                                     user_id=uid,
+                                     post_id=post_key.id()))
+        return entities, [], len(rows) - len(rows_ok)
+
+
+def import_kind(importer, kind, directory, state, batch_size):
+    """
+        Imports <dir>/<kind>.ndjson one batch at a time, from the
+        offset saved after the last complete batch.
+    """
+    progress = state.kind(kind)
+    path = os.path.join(directory, kind + '.ndjson')
+    if progress['done'] or not os.path.exists(path):
+        return 0
+    meter = Meter(kind)
+    with open(path, 'rb') as f:
+        f.seek(progress['offset'])
+        while True:
+            rows = read_batch(f, batch_size)
+            if rows:
+                progress['skipped'] += importer.import_batch(kind, rows)
+            progress['offset'] = f.tell()
+            progress['rows'] += len(rows)
+            progress['done'] = len(rows) < batch_size
+            state.save()
+            meter.add(len(rows), progress['rows'])
+            if progress['done']:
+                break
+    if importer.rejected:
+        print('%-8s %9d rows rejected, their name is taken: %s' %
+              (kind, len(importer.rejected), ', '.join(importer.rejected)))
+        importer.rejected = []
+    if progress['skipped']:
+        print('%-8s %9d rows skipped, their name is taken, or their '
+              'user or post is missing' % (kind, progress['skipped']))
+    return meter.rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('directory', help='directory of the .ndjson files')
+    parser.add_argument('--sdk', default=os.environ.get('GAE_SDK'),
+                        help='path of the App Engine SDK (google_appengine)')
+    parser.add_argument('--remote', metavar='HOST',
+                        help='use the datastore of the app at HOST through '
+                             'remote_api, instead of the local stub')
+    parser.add_argument('--datastore-file',
+                        help='datastore file of the dev server, for the '
+                             'local stub')
+    parser.add_argument('--app-id', default='dev~udacity-multi-blog-project',
+                        help='application id of the local stub')
+    parser.add_argument('--batch-size', type=int, default=200)
+    parser.add_argument('--kind', action='append', choices=KINDS,
+                        help='only this kind, may be repeated')
+    args = parser.parse_args()
+    if not args.sdk:
+        parser.error('--sdk or GAE_SDK is required')
+
+    if not os.path.isdir(args.directory):
+        os.makedirs(args.directory)
+    bed = connect(args)
+    try:
+        models = get_models()
+        state = State(args.directory, args.command)
+        started = time.time()
+        importer = args.command == 'import' and Importer(models)
+        rows = 0
+        for kind in KINDS:
+            if args.kind and kind not in args.kind:
+                continue
+            if importer:
+                rows += import_kind(importer, kind, args.directory, state,
+                                    args.batch_size)
+            else:
+                rows += export_kind(models, kind, args.directory, state,
+                                    args.batch_size)
+        elapsed = time.time() - started
+        print('%d rows in %.1f s, %.0f rows/s' % (
+            rows, elapsed, rows / elapsed if elapsed else 0))
+        if importer:
+            print('Rebuild the like counters, user totals and search index '
+                  'with /admin/backfill/likes, /admin/backfill/userstats '
+                  'and /admin/search/rebuild.')
+    finally:
+        if bed:
+            bed.deactivate()
+
+
+if __name__ == '__main__':
+    main()
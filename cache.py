@@ -0,0 +1,179 @@
+import time
+import logging
+import threading
+import collections
+
+from google.appengine.api import memcache
+
+import instrument
+
+
+class LRUCache(object):
+    """
+        This is a LRUCache Class, a bounded in-process cache which drops
+        the least recently used entry when it is full.
+
+        Attributes:
+            max_size (int): This is the maximum number of entries.
+            ttl (int): This is the lifetime of an entry in seconds,
+                       None keeps entries until they are evicted.
+    """
+
+    def __init__(self, max_size=1000, ttl=None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """
+            Returns the value stored under {key}, or None.
+        """
+        with self._lock:
+            item = self._data.pop(key, None)
+            if item is None or (item[1] and item[1] < time.time()):
+                self.misses += 1
+                return None
+            # re-insert, so the entry becomes the most recently used
+            self._data[key] = item
+            self.hits += 1
+            return item[0]
+
+    def set(self, key, value, ttl=None):
+        """
+            Stores {value} under {key}, evicting old entries if needed.
+        """
+        ttl = ttl or self.ttl
+        expires = ttl and time.time() + ttl
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = (value, expires)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+        return True
+
+    def delete(self, key):
+        """
+            Removes {key} from the cache.
+        """
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def stats(self):
+        """
+            Returns the hit, miss and eviction counters of the cache.
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions, 'size': len(self._data),
+                'max_size': self.max_size}
+
+
+# in-process cache used whenever memcache is unavailable
+local = LRUCache(max_size=500)
+
+
+def get(key):
+    """
+        Returns the value cached under {key}, or None.
+        Looks in memcache first, then in the local fallback cache.
+    """
+    try:
+        value = memcache.get(key)
+    except Exception:
+        logging.warning('memcache get failed for %s', key, exc_info=True)
+        value = None
+    if value is None:
+        value = local.get(key)
+    instrument.add('cache_misses' if value is None else 'cache_hits')
+    return value
+
+
+def set(key, value, time=0):
+    """
+        Caches {value} under {key} for {time} seconds (0 = no expiry).
+        Falls back to the local cache if memcache refuses the value.
+    """
+    try:
+        stored = memcache.set(key, value, time=time)
+    except Exception:
+        logging.warning('memcache set failed for %s', key, exc_info=True)
+        stored = False
+    if not stored:
+        local.set(key, value, ttl=time or None)
+    return True
+
+
+def delete(key):
+    """
+        Removes {key} from memcache and from the local cache.
+    """
+    local.delete(key)
+    try:
+        memcache.delete(key)
+    except Exception:
+        logging.warning('memcache delete failed for %s', key, exc_info=True)
+
+
+def incr(key, initial=0):
+    """
+        Atomically increments the counter {key}, starting from {initial}.
+        Returns the new value.
+    """
+    try:
+        value = memcache.incr(key, initial_value=initial)
+    except Exception:
+        logging.warning('memcache incr failed for %s', key, exc_info=True)
+        value = None
+    if value is None:
+        value = (local.get(key) or initial) + 1
+        local.set(key, value)
+    return value
+
+
+def generation(key, bump=False):
+    """
+        Returns the generation counter {key}, incremented first when
+        {bump} is set. A counter missing from the cache starts from the
+        current time in milliseconds, above any value it had before it
+        was evicted, so an old generation is never given out again.
+    """
+    value = None if bump else get(key)
+    if value is None:
+        value = incr(key, initial=int(time.time() * 1000))
+    return value
+
+
+def page_key(path, query_string=''):
+    """
+        Returns the cache key of the page at {path} and {query_string}.
+        The key embeds the generation of {path}, so invalidate_page()
+        drops every cached variant of the page at once.
+    """
+    return 'page:%s:%s?%s' % (generation('page-generation:' + path), path,
+                              query_string)
+
+
+def invalidate_page(path):
+    """
+        Invalidates every cached response for {path}.
+    """
+    generation('page-generation:' + path, bump=True)
+
+
+def stats():
+    """
+        Returns the memcache and local cache statistics.
+    """
+    try:
+        shared = memcache.get_stats()
+    except Exception:
+        shared = None
+    return {'memcache': shared, 'local': local.stats()}
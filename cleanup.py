@@ -0,0 +1,170 @@
+import logging
+
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+from post import blog_key
+from comment import Comment
+from like import Like
+import counter
+import activity
+
+# most keys passed to one db.delete call
+BATCH_SIZE = 500
+
+# posts with more comments and likes than this are cleaned up by a task
+INLINE_LIMIT = 200
+
+# batches deleted by one task before it hands over to the next
+BATCHES_PER_TASK = 20
+
+
+# PostDeletion Model
+class PostDeletion(db.Model):
+    """
+        This is a PostDeletion Class, which tracks the background removal
+        of the comments and likes of a deleted post.
+        The key name is the id of the post.
+
+        Attributes:
+            deleted (int): This is the number of entities removed so far.
+            done (bool): This is set once nothing is left to remove.
+    """
+    deleted = db.IntegerProperty(default=0)
+    done = db.BooleanProperty(default=False)
+    created = db.DateTimeProperty(auto_now_add=True)
+    last_modified = db.DateTimeProperty(auto_now=True)
+
+
+def child_keys(post_key, limit=BATCH_SIZE, authors=None):
+    """
+        Returns up to {limit} keys of comments and likes of the post of
+        {post_key}. When {authors} is given, the number of returned
+        comments of each user is added to it. The queries are ancestor
+        queries, so keys deleted by an earlier batch never come back.
+    """
+    post_id = post_key.id()
+    # children of posts not migrated yet live under blog_key()
+    ancestor = post_key.parent() or post_key
+    keys = []
+    # comments are read with their author, for the user totals
+    comments = Comment.all(projection=('user_id',)).ancestor(ancestor) \
+        .filter('post_id =', post_id)
+    for c in comments.fetch(limit):
+        keys.append(c.key())
+        if authors is not None:
+            authors[c.user_id] = authors.get(c.user_id, 0) + 1
+    if len(keys) < limit:
+        likes = Like.all(keys_only=True).ancestor(ancestor) \
+            .filter('post_id =', post_id)
+        keys.extend(likes.fetch(limit - len(keys)))
+    return keys
+
+
+def delete_children(post_key, max_batches=None):
+    """
+        Deletes the comments and likes of the post of {post_key} in
+        batches, and takes the comments off their authors' totals.
+        Returns the number of deleted entities and whether any are left.
+    """
+    deleted = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        authors = {}
+        keys = child_keys(post_key, authors=authors)
+        # the totals go first, named after the batch: a retry after a
+        # failed delete reads the same batch and counts nothing twice
+        for user_id, comments in authors.items():
+            activity.add(user_id, comments=-comments,
+                         op='delete-comments:%s' % keys[0])
+        if keys:
+            db.delete(keys)
+            deleted += len(keys)
+            batches += 1
+        if len(keys) < BATCH_SIZE:
+            return deleted, False
+    return deleted, True
+
+
+def delete_post(post):
+    """
+        Deletes {post} with its comments, likes and like counter,
+        and updates the totals of its author.
+        Large posts get their comments and likes removed by a task.
+    """
+    post_key = post.key()
+    post_id = post_key.id()
+    likes = counter.get_count(post_id)
+    post.delete()
+    db.delete(counter.shard_keys(post_id))
+    activity.add(post.user_id, posts=-1, likes=-likes,
+                 op='delete-post:%d' % post_id)
+
+    if len(child_keys(post_key, INLINE_LIMIT + 1)) <= INLINE_LIMIT:
+        delete_children(post_key)
+    else:
+        PostDeletion(key_name=str(post_id)).put()
+        deferred.defer(delete_children_task, post_key)
+
+
+def delete_children_task(post_key):
+    """
+        Task that removes the comments and likes of the post of
+        {post_key} and records its progress. Retrying it is harmless.
+    """
+    if not isinstance(post_key, db.Key):
+        # queued before tasks were given keys, by a post id of a post
+        # then already out of blog_key()
+        post_key = db.Key.from_path('Post', int(post_key))
+    deleted, more = delete_children(post_key, BATCHES_PER_TASK)
+
+    def txn():
+        progress = PostDeletion.get_by_key_name(str(post_key.id()))
+        if not progress:
+            progress = PostDeletion(key_name=str(post_key.id()))
+        progress.deleted += deleted
+        progress.done = not more
+        progress.put()
+    db.run_in_transaction(txn)
+
+    if more:
+        deferred.defer(delete_children_task, post_key)
+
+
+def delete_orphans(model, cursor=None, batch_size=BATCH_SIZE):
+    """
+        Task that removes {model} rows whose post no longer exists,
+        going through the kind one batch per task.
+    """
+    query = model.all(projection=('post_id',))
+    if cursor:
+        query.with_cursor(cursor)
+    rows = query.fetch(batch_size)
+
+    post_ids = list(set(row.post_id for row in rows))
+    keys = []
+    for post_id in post_ids:
+        keys.append(db.Key.from_path('Post', post_id))
+        keys.append(db.Key.from_path('Post', post_id, parent=blog_key()))
+    posts = db.get(keys) if keys else []
+    alive = set(post_id for i, post_id in enumerate(post_ids)
+                if posts[2 * i] or posts[2 * i + 1])
+
+    orphans = [row.key() for row in rows if row.post_id not in alive]
+    if orphans:
+        db.delete(orphans)
+        logging.info('Deleted %d orphan %s rows', len(orphans),
+                     model.kind())
+
+    if len(rows) == batch_size:
+        deferred.defer(delete_orphans, model, query.cursor(), batch_size)
+    else:
+        logging.info('Orphan %s collection finished', model.kind())
+
+
+def collect_garbage():
+    """
+        Starts the orphan collection of comments and likes.
+    """
+    for model in (Comment, Like):
+        deferred.defer(delete_orphans, model)
@@ -1,6 +1,7 @@
 from google.appengine.ext import db
 
-from user import User
+from user import user_name
+from post import blog_key
 
 
 class Comment(db.Model):
@@ -10,6 +11,22 @@ class Comment(db.Model):
     created = db.DateTimeProperty(auto_now_add=True)
     last_modified = db.DateTimeProperty(auto_now=True)
 
+    @classmethod
+    def by_id(self, post_id, comment_id):
+        """
+            This method fetchs the Comment {comment_id} of post {post_id},
+            under the post, under the post still in blog_key(), or
+            under blog_key() for older comments.
+        """
+        post_id, comment_id = int(post_id), int(comment_id)
+        comment, unmigrated, legacy = db.get([
+            db.Key.from_path('Post', post_id, 'Comment', comment_id),
+            db.Key.from_path('Comment', comment_id, parent=db.Key.from_path(
+                'Post', post_id, parent=blog_key())),
+            db.Key.from_path('Comment', comment_id, parent=blog_key())])
+        if legacy and legacy.post_id != post_id:
+            legacy = None
+        return comment or unmigrated or legacy
+
     def getUserName(self):
-        user = User.by_id(self.user_id)
-        return user.name
+        return user_name(self)
@@ -0,0 +1,29 @@
+"""
+    Precompiles the jinja templates into python modules, which
+    TemplateFile loads instead of parsing the templates on every new
+    instance. Run it with the python 2.7 used by App Engine before
+    deploying, TemplateFile ignores the compiled templates once a
+    template file changes:
+
+        $ python compile_templates.py
+"""
+import json
+
+import jinja2
+
+import TemplateFile
+
+
+def main():
+    env = TemplateFile.make_env(
+        jinja2.FileSystemLoader(TemplateFile.template_dir))
+    env.compile_templates(TemplateFile.compiled_dir, zip=None,
+                          ignore_errors=False)
+    with open(TemplateFile.manifest_path, 'w') as f:
+        json.dump(TemplateFile.source_hashes(), f, indent=2, sort_keys=True)
+    print('Compiled %d templates into %s' % (len(env.list_templates()),
+                                              TemplateFile.compiled_dir))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import random
+import logging
+
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+from post import Post
+import queries
+
+# number of shards each post's like counter is spread over
+NUM_SHARDS = 20
+
+
+# LikeCounterShard Model
+class LikeCounterShard(db.Model):
+    """
+        This is a LikeCounterShard Class, which holds one slice of the
+        like count of a post. Spreading the count over several entities
+        lets many users like the same post at once without contention.
+
+        Attributes:
+            count (int): This is the number of likes kept in this shard.
+    """
+    count = db.IntegerProperty(required=True, default=0)
+
+
+def shard_keys(post_id):
+    """
+        Returns the keys of all counter shards of post {post_id}.
+    """
+    return [db.Key.from_path('LikeCounterShard',
+                             'post-%d-%d' % (int(post_id), i))
+            for i in xrange(NUM_SHARDS)]
+
+
+def increment(post_id, delta=1):
+    """
+        Adds {delta} to a random shard of post {post_id}.
+        Must run inside a transaction.
+    """
+    key = random.choice(shard_keys(post_id))
+    shard = db.get(key)
+    if not shard:
+        shard = LikeCounterShard(key=key)
+    shard.count += delta
+    shard.put()
+
+
+def get_counts_async(post_ids):
+    """
+        Starts reading the counters of all {post_ids} with a single
+        batch get. Returns a function which waits for the
+        {post_id: likes} dict.
+    """
+    post_ids = [int(post_id) for post_id in post_ids]
+    keys = []
+    for post_id in post_ids:
+        keys.extend(shard_keys(post_id))
+    rpc = keys and db.get_async(keys)
+
+    def result():
+        shards = rpc.get_result() if rpc else []
+        counts = {}
+        for i, post_id in enumerate(post_ids):
+            chunk = shards[i * NUM_SHARDS:(i + 1) * NUM_SHARDS]
+            counts[post_id] = sum(s.count for s in chunk if s)
+        return counts
+    return result
+
+
+def get_counts(post_ids):
+    """
+        Returns {post_id: likes} for all {post_ids}.
+    """
+    return get_counts_async(post_ids)()
+
+
+def get_count_async(post_id):
+    """
+        Starts reading the number of likes of post {post_id}.
+        Returns a function which waits for it.
+    """
+    counts = get_counts_async([post_id])
+    return lambda: counts()[int(post_id)]
+
+
+def get_count(post_id):
+    """
+        Returns the number of likes of post {post_id}.
+    """
+    return get_count_async(post_id)()
+
+
+def rebuild(post_id):
+    """
+        Recomputes the counter of post {post_id} from its Like rows,
+        and returns the new count. The likes are counted and the shards
+        written in one transaction, so a like written meanwhile is
+        neither lost nor counted twice.
+    """
+    post_id = int(post_id)
+    post = Post.by_id(post_id)
+    post_key = post.key() if post else db.Key.from_path('Post', post_id)
+    # likes of posts not migrated yet live under blog_key()
+    ancestor = post_key.parent() or post_key
+
+    def txn():
+        total = queries.count('likes_by_post', [ancestor, post_id])
+        shards = [LikeCounterShard(key=key, count=0)
+                  for key in shard_keys(post_id)]
+        shards[0].count = total
+        db.put(shards)
+        return total
+    # the likes' entity group and every shard
+    options = db.create_transaction_options(xg=True)
+    return db.run_in_transaction_options(options, txn)
+
+
+def backfill(cursor=None, batch_size=100):
+    """
+        Rebuilds the counters of one batch of posts, starting at {cursor}.
+        Returns the cursor of the next batch, or None when all posts
+        have been processed.
+    """
+    query = Post.all(keys_only=True)
+    if cursor:
+        query.with_cursor(cursor)
+    keys = query.fetch(batch_size)
+    for key in keys:
+        rebuild(key.id())
+    if len(keys) < batch_size:
+        return None
+    return query.cursor()
+
+
+def backfill_all(cursor=None):
+    """
+        Task that rebuilds every like counter, one batch per task.
+    """
+    cursor = backfill(cursor)
+    if cursor:
+        deferred.defer(backfill_all, cursor)
+    else:
+        logging.info('Like counter backfill finished')
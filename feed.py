@@ -0,0 +1,80 @@
+import json
+
+from post import Post
+from user import prefetch_names
+import TemplateFile
+import cache
+
+# number of newest posts listed in the feeds
+FEED_SIZE = 20
+
+# feed paths and their content types
+FEEDS = {
+    '/feed.atom': 'application/atom+xml; charset=utf-8',
+    '/feed.json': 'application/feed+json; charset=utf-8',
+}
+
+
+def latest_posts():
+    """
+        Returns the newest FEED_SIZE posts, with their author names.
+    """
+    posts = Post.all().order('-created').fetch(FEED_SIZE)
+    prefetch_names(posts)
+    return posts
+
+
+# RFC 3339 timestamps, as Atom and JSON Feed want them
+DATE_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+def render_atom(posts, base_url):
+    """
+        Returns the Atom document of {posts}.
+    """
+    updated = max(p.last_modified for p in posts) if posts else None
+    return TemplateFile.jinja_render_str(
+        'feed.atom', posts=posts, base_url=base_url,
+        updated=updated.strftime(DATE_FORMAT) if updated else
+        '1970-01-01T00:00:00Z', date_format=DATE_FORMAT)
+
+
+def render_json(posts, base_url):
+    """
+        Returns the JSON Feed 1.1 document of {posts}.
+    """
+    return json.dumps({
+        'version': 'https://jsonfeed.org/version/1.1',
+        'title': 'Multi Blog',
+        'home_page_url': base_url + '/',
+        'feed_url': base_url + '/feed.json',
+        'items': [{
+            'id': '%s/blog/%d' % (base_url, p.key().id()),
+            'url': '%s/blog/%d' % (base_url, p.key().id()),
+            'title': p.subject,
+            'content_html': p.content_html(),
+            'summary': p.excerpt,
+            'date_published': p.created.strftime(DATE_FORMAT),
+            'date_modified': p.last_modified.strftime(DATE_FORMAT),
+            'authors': [{'name': p.getUserName(),
+                         'url': '%s/user/%s' % (base_url, p.getUserName())}],
+        } for p in posts],
+    })
+
+
+def render(path, posts, base_url):
+    """
+        Returns the body of the feed at {path}.
+    """
+    if path == '/feed.atom':
+        return render_atom(posts, base_url)
+    return render_json(posts, base_url)
+
+
+def invalidate():
+    """
+        Drops the cached feeds, after a post was created, edited or
+        deleted.
+    """
+    for path in FEEDS:
+        cache.invalidate_page(path)
@@ -0,0 +1,248 @@
+import os
+import json
+import time
+import random
+import logging
+import pstats
+import cProfile
+import StringIO
+import threading
+import collections
+
+from google.appengine.api import apiproxy_stub_map
+
+# share of requests run under cProfile, 0 disables the profiler
+PROFILE_SAMPLE_RATE = float(os.environ.get('PROFILE_SAMPLE_RATE', 0))
+
+# profiled requests slower than this get their profile logged
+PROFILE_SLOW_MS = float(os.environ.get('PROFILE_SLOW_MS', 500))
+
+# per request thread counters
+_local = threading.local()
+
+
+class Histogram(object):
+    """
+        This is a Histogram Class, which counts values in fixed buckets
+        and estimates percentiles from them.
+
+        Attributes:
+            bounds (list): This is the upper bound of each bucket.
+    """
+    bounds = [1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000,
+              float('inf')]
+
+    def __init__(self):
+        self.counts = [0] * len(self.bounds)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value):
+        for i, bound in enumerate(self.bounds):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.count += 1
+        self.total += value
+
+    def percentile(self, p):
+        """
+            Returns the upper bound of the bucket holding percentile {p}.
+        """
+        seen = 0
+        for bound, count in zip(self.bounds, self.counts):
+            seen += count
+            if count and seen >= self.count * p / 100.0:
+                # values past the last bound are reported as that bound
+                return min(bound, self.bounds[-2])
+        return 0
+
+    def summary(self):
+        return {'count': self.count,
+                'mean': self.count and self.total / self.count,
+                'p50': self.percentile(50), 'p95': self.percentile(95),
+                'p99': self.percentile(99),
+                'buckets': zip([str(b) for b in self.bounds], self.counts)}
+
+
+# route -> metric -> Histogram, for this instance
+histograms = collections.defaultdict(
+    lambda: collections.defaultdict(Histogram))
+_histograms_lock = threading.Lock()
+
+
+def start_request():
+    """
+        Resets the counters of this thread for a new request.
+    """
+    _local.rpcs = 0
+    _local.started = time.time()
+    _local.timeline = []
+    _local.pending = {}
+    _local.route = None
+    _local.metrics = collections.defaultdict(float)
+
+
+def finish_request():
+    """
+        Adds the measures of the finished request to the histograms,
+        and returns its route and measures.
+    """
+    latency = elapsed()
+    # unmatched paths share one entry, so stray urls cannot grow the stats
+    route = getattr(_local, 'route', None) or 'unmatched'
+    measures = dict(getattr(_local, 'metrics', {}))
+    measures['latency_ms'] = latency
+    measures['rpc_count'] = rpc_count()
+
+    with _histograms_lock:
+        for metric, value in measures.items():
+            histograms[route][metric].add(value)
+
+    # the timeline stays empty until the next request starts
+    _local.__dict__.pop('timeline', None)
+    _local.__dict__.pop('metrics', None)
+    return route, measures
+
+
+def set_route(route):
+    """
+        Names the route the current request is counted under.
+    """
+    _local.route = route
+
+
+def add(metric, value=1):
+    """
+        Adds {value} to {metric} of the current request.
+    """
+    metrics = getattr(_local, 'metrics', None)
+    if metrics is not None:
+        metrics[metric] += value
+
+
+def rpc_count():
+    """
+        Returns the number of datastore calls made by this thread.
+    """
+    return getattr(_local, 'rpcs', 0)
+
+
+def timeline():
+    """
+        Returns the datastore calls of the current request as
+        (call, start ms, end ms) tuples, relative to the request start.
+    """
+    return [tuple(event[:3]) for event in getattr(_local, 'timeline', [])]
+
+
+def format_timeline():
+    """
+        Returns the timeline as text, one call per line.
+    """
+    lines = []
+    for call, start, end in timeline():
+        end = '%7.1f ms' % end if end is not None else 'unfinished'
+        lines.append('%-12s %7.1f -> %s' % (call, start, end))
+    return '\n'.join(lines)
+
+
+def elapsed():
+    return (time.time() - getattr(_local, 'started', time.time())) * 1000
+
+
+def rpc_kind(call, request):
+    """
+        Returns the entity kind a datastore call works on.
+    """
+    try:
+        if call == 'RunQuery':
+            return request.kind()
+        if call in ('Get', 'Delete'):
+            key = request.key_list()[0]
+        elif call == 'Put':
+            key = request.entity_list()[0].key()
+        else:
+            return call
+        return key.path().element_list()[-1].type()
+    except Exception:
+        return call
+
+
+def rpc_started(service, call, request, response, rpc=None):
+    """
+        Hook run by the api proxy before every datastore call.
+    """
+    _local.rpcs = rpc_count() + 1
+    if hasattr(_local, 'timeline'):
+        event = [call, elapsed(), None, rpc_kind(call, request)]
+        _local.timeline.append(event)
+        _local.pending[id(rpc or response)] = event
+
+
+def rpc_finished(service, call, request, response, rpc=None):
+    """
+        Hook run by the api proxy once a datastore call has returned.
+    """
+    event = getattr(_local, 'pending', {}).pop(id(rpc or response), None)
+    if event:
+        event[2] = elapsed()
+        add('rpc_ms.%s' % event[3], event[2] - event[1])
+        add('rpc_count.%s' % event[3])
+
+
+def install_hooks():
+    """
+        Adds the datastore call hooks to the current api proxy. Runs at
+        import; tests call it again after a testbed replaces the proxy.
+    """
+    apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+        'blog_rpc_started', rpc_started, 'datastore_v3')
+    apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+        'blog_rpc_finished', rpc_finished, 'datastore_v3')
+
+
+install_hooks()
+
+
+def stats():
+    """
+        Returns the histogram summaries of every route.
+    """
+    with _histograms_lock:
+        return dict((route, dict((metric, h.summary())
+                                 for metric, h in metrics.items()))
+                    for route, metrics in histograms.items())
+
+
+class StatsMiddleware(object):
+    """
+        This is a StatsMiddleware Class, a WSGI middleware which measures
+        every request, logs the measures as JSON and, for a sample of
+        requests, runs the app under cProfile.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    def __call__(self, environ, start_response):
+        start_request()
+        profiler = None
+        if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+            profiler = cProfile.Profile()
+        try:
+            if profiler:
+                return profiler.runcall(self.app, environ, start_response)
+            return self.app(environ, start_response)
+        finally:
+            path = environ.get('PATH_INFO', '')
+            route, measures = finish_request()
+            logging.info(json.dumps({'request': path, 'route': route,
+                                     'method': environ.get('REQUEST_METHOD'),
+                                     'measures': measures}))
+            if profiler and measures['latency_ms'] > PROFILE_SLOW_MS:
+                out = StringIO.StringIO()
+                pstats.Stats(profiler, stream=out).sort_stats(
+                    'cumulative').print_stats(40)
+                logging.warning('Slow request %s (%.0f ms) profile:\n%s',
+                                path, measures['latency_ms'], out.getvalue())
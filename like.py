@@ -1,12 +1,22 @@
 from google.appengine.ext import db
 
-from user import User
+from user import user_name
 
 
 class Like(db.Model):
     user_id = db.IntegerProperty(required=True)
     post_id = db.IntegerProperty(required=True)
 
+    @classmethod
+    def make_key(self, post_key, user_id):
+        """
+            This method returns the key of the Like of user {user_id}
+            on the post of {post_key}. Each user has one key per post,
+            so a like cannot be stored twice.
+        """
+        return db.Key.from_path('Like', '%d-%d' % (int(user_id),
+                                                   post_key.id()),
+                                parent=post_key)
+
     def getUserName(self):
-        user = User.by_id(self.user_id)
-        return user.name
+        return user_name(self)
@@ -0,0 +1,142 @@
+"""
+    A small, sanitizing Markdown renderer for post bodies.
+
+    The text is html-escaped before any formatting is applied, and links
+    only accept http, https, mailto and relative urls, so no markup
+    written by a user reaches the page. Supported syntax: paragraphs,
+    line breaks, # headings, - and 1. lists, > quotes, ``` code blocks,
+    `code`, **strong**, *emphasis* and [links](url).
+"""
+import re
+import cgi
+import HTMLParser
+
+# bump when the output changes, so stored html and summaries get
+# rendered again
+RENDERER_VERSION = 3
+
+# most nested > quotes rendered as blockquotes
+MAX_QUOTE_DEPTH = 8
+
+HEADING_RE = re.compile(r'^(#{1,6})\s+(.*?)\s*#*$')
+BULLET_RE = re.compile(r'^\s*[-*+]\s+(.*)$')
+NUMBER_RE = re.compile(r'^\s*\d+[.)]\s+(.*)$')
+QUOTE_RE = re.compile(r'^&gt;\s?(.*)$')
+FENCE_RE = re.compile(r'^```')
+
+CODE_RE = re.compile(r'`([^`]+)`')
+STRONG_RE = re.compile(r'\*\*(?=\S)(.+?)(?<=\S)\*\*')
+EM_RE = re.compile(r'(?<![*\w])\*(?=\S)(.+?)(?<=\S)\*(?![*\w])')
+LINK_RE = re.compile(r'\[([^\]]+)\]\(([^)\s]+)\)')
+SAFE_URL_RE = re.compile(r'^(https?://|mailto:|/|#)', re.IGNORECASE)
+TAG_RE = re.compile(r'<[^>]+>')
+
+
+def render_link(match):
+    text, url = match.group(1), match.group(2)
+    if not SAFE_URL_RE.match(url):
+        return match.group(0)
+    return '<a href="%s" rel="nofollow">%s</a>' % (url, text)
+
+
+def render_inline(text):
+    """
+        Formats the inline syntax of already escaped {text}.
+    """
+    # keep code spans and rendered links out of the other rules
+    stashed = []
+
+    def stash(html):
+        stashed.append(html)
+        return '\x00%d\x00' % (len(stashed) - 1)
+
+    def stash_link(match):
+        html = render_link(match)
+        return html if html == match.group(0) else stash(html)
+
+    text = CODE_RE.sub(lambda m: stash('<code>%s</code>' % m.group(1)), text)
+    text = LINK_RE.sub(stash_link, text)
+    text = STRONG_RE.sub(r'<strong>\1</strong>', text)
+    text = EM_RE.sub(r'<em>\1</em>', text)
+    return re.sub('\x00(\\d+)\x00', lambda m: stashed[int(m.group(1))],
+                  text)
+
+
+def render_block(lines, depth=0):
+    """
+        Renders one block of consecutive non-empty lines, inside
+        {depth} quotes.
+    """
+    # headings at the start of the block, each on its own line
+    html = []
+    while lines and HEADING_RE.match(lines[0]):
+        heading = HEADING_RE.match(lines[0])
+        level = len(heading.group(1))
+        html.append('<h%d>%s</h%d>' % (level, render_inline(heading.group(2)),
+                                       level))
+        lines = lines[1:]
+    if lines:
+        html.append(render_body(lines, depth))
+    return '\n'.join(html)
+
+
+def render_body(lines, depth):
+    for pattern, tag in ((BULLET_RE, 'ul'), (NUMBER_RE, 'ol')):
+        items = [pattern.match(line) for line in lines]
+        if all(items):
+            return '<%s>%s</%s>' % (tag, ''.join(
+                '<li>%s</li>' % render_inline(item.group(1))
+                for item in items), tag)
+
+    # deeper quotes are shown as text
+    quotes = [QUOTE_RE.match(line) for line in lines]
+    if all(quotes) and depth < MAX_QUOTE_DEPTH:
+        return '<blockquote>%s</blockquote>' % render_blocks(
+            [quote.group(1) for quote in quotes], depth + 1)
+
+    return '<p>%s</p>' % '<br>'.join(render_inline(line) for line in lines)
+
+
+def render_blocks(lines, depth=0):
+    blocks = []
+    block = []
+    code = None
+    for line in lines:
+        if code is not None:
+            if FENCE_RE.match(line):
+                blocks.append('<pre><code>%s</code></pre>' % '\n'.join(code))
+                code = None
+            else:
+                code.append(line)
+        elif FENCE_RE.match(line):
+            if block:
+                blocks.append(render_block(block, depth))
+                block = []
+            code = []
+        elif line.strip():
+            block.append(line.rstrip())
+        elif block:
+            blocks.append(render_block(block, depth))
+            block = []
+    if code is not None:
+        blocks.append('<pre><code>%s</code></pre>' % '\n'.join(code))
+    if block:
+        blocks.append(render_block(block, depth))
+    return '\n'.join(blocks)
+
+
+def render(text):
+    """
+        Returns the sanitized html of Markdown {text}.
+    """
+    # NUL marks the code spans of render_inline(), it has no place in text
+    text = cgi.escape((text or '').replace('\x00', ''), quote=True)
+    return render_blocks(text.replace('\r\n', '\n').split('\n'))
+
+
+def html_text(html):
+    """
+        Returns the plain text of {html} made by render(), without its
+        tags and entities.
+    """
+    return HTMLParser.HTMLParser().unescape(TAG_RE.sub(' ', html))
@@ -0,0 +1,148 @@
+import logging
+
+from google.appengine.api import datastore
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+from post import Post, blog_key
+from comment import Comment
+from like import Like
+import markup
+import cache
+import feed
+
+
+def copy_entity(entity, key):
+    """
+        Returns a copy of {entity} stored under {key}, as a
+        datastore.Entity: a put of the model would stamp its auto_now
+        dates with the time of the copy.
+    """
+    props = entity.properties()
+    copy = datastore.Entity(
+        entity.kind(), parent=key.parent(), name=key.name(), id=key.id(),
+        unindexed_properties=[name for name, prop in props.items()
+                              if not prop.indexed])
+    for name, prop in props.items():
+        if isinstance(prop, db.DateTimeProperty):
+            copy[name] = getattr(entity, name)
+        else:
+            copy[name] = prop.get_value_for_datastore(entity)
+    return copy
+
+
+# most entities written or deleted in one call
+WRITE_BATCH = 500
+
+
+def reserve_ids(keys):
+    """
+        Keeps the datastore from handing out the ids of {keys}, which
+        share a parent and kind, to new entities, so moved entities can
+        keep their ids. One call reserves the whole range; keys with a
+        name need nothing.
+    """
+    ids = [key.id() for key in keys if key.id()]
+    if ids:
+        db.allocate_id_range(keys[0], min(ids), max(ids))
+
+
+def new_child_key(child, new_post_key):
+    """
+        Returns the key of {child} under {new_post_key}. Likes are keyed
+        by user and post, the others keep their id or name.
+    """
+    if isinstance(child, Like):
+        return Like.make_key(new_post_key, child.user_id)
+    return db.Key.from_path(child.kind(), child.key().id_or_name(),
+                            parent=new_post_key)
+
+
+def migrate_post(post):
+    """
+        Moves {post} and its comments and likes out of blog_key():
+        the post becomes an entity group root keeping its id, and its
+        comments and likes become its children. Safe to run twice, and
+        to run again after a failure part way.
+    """
+    post_id = post.key().id()
+    new_post_key = db.Key.from_path('Post', post_id)
+    existing = db.get(new_post_key)
+    if existing and (existing.user_id, existing.created) != \
+            (post.user_id, post.created):
+        logging.warning('Another post %d already exists outside '
+                        'blog_key(), leaving the old one in place', post_id)
+        return 0
+    reserve_ids([new_post_key])
+
+    old = []
+    new = [copy_entity(post, new_post_key)]
+    for model in (Comment, Like):
+        # children of blog_key(), and of the post itself for writes
+        # made while it was still there
+        children = model.all().ancestor(blog_key()).filter('post_id =',
+                                                            post_id)
+        keys = []
+        for child in children.run(batch_size=WRITE_BATCH):
+            key = new_child_key(child, new_post_key)
+            keys.append(key)
+            old.append(child.key())
+            new.append(copy_entity(child, key))
+        if model is Comment:
+            reserve_ids(keys)
+
+    # write every copy before removing the originals, and remove the
+    # post last: a retry after a failure part way still finds the post,
+    # takes the copy as its own and only rewrites the same keys
+    for i in xrange(0, len(new), WRITE_BATCH):
+        datastore.Put(new[i:i + WRITE_BATCH])
+    old.append(post.key())
+    for i in xrange(0, len(old), WRITE_BATCH):
+        db.delete(old[i:i + WRITE_BATCH])
+    return len(new)
+
+
+def migrate_posts(cursor=None, batch_size=20):
+    """
+        Task that migrates the posts still under blog_key(),
+        one batch of posts per task.
+    """
+    query = Post.all().ancestor(blog_key())
+    if cursor:
+        query.with_cursor(cursor)
+    posts = query.fetch(batch_size)
+    moved = sum(migrate_post(post) for post in posts)
+    logging.info('Moved %d entities out of blog_key()', moved)
+    if len(posts) == batch_size:
+        deferred.defer(migrate_posts, query.cursor(), batch_size)
+    else:
+        logging.info('Entity group migration finished')
+
+
+def rerender_posts(cursor=None, batch_size=100):
+    """
+        Task that stores the html and summary of posts rendered by an
+        older markup version or before summaries existed, one batch of
+        posts per task.
+    """
+    query = Post.all()
+    if cursor:
+        query.with_cursor(cursor)
+    posts = query.fetch(batch_size)
+    stale = [post for post in posts
+             if post.renderer_version != markup.RENDERER_VERSION or
+             post.excerpt is None]
+    for post in stale:
+        post.render_content()
+    db.put(stale)
+    for post in stale:
+        cache.invalidate_page('/blog/%d' % post.key().id())
+    if stale:
+        cache.invalidate_page('/')
+        feed.invalidate()
+        logging.info('Rendered %d stale posts again', len(stale))
+
+    if len(posts) == batch_size:
+        deferred.defer(rerender_posts, query.cursor(), batch_size)
+    else:
+        logging.info('Post rendering finished')
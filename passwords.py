@@ -0,0 +1,182 @@
+"""
+    Password hashers.
+
+    New hashes are written as algorithm$iterations$salt$hash by the
+    default hasher, PBKDF2-SHA256 unless PASSWORD_HASHER names another
+    one. Its iteration count is calibrated once per instance, so one hash
+    takes about PASSWORD_HASH_MS milliseconds on the running machine.
+    Hashes of older formats, like the salt,hash SHA-256 of the first
+    version, still verify, and needs_update() tells when a hash should
+    be made again with the current settings.
+"""
+import os
+import hmac
+import time
+import base64
+import hashlib
+
+# milliseconds one password hash should take on this instance
+PASSWORD_HASH_MS = float(os.environ.get('PASSWORD_HASH_MS', 100))
+
+# fixed iteration count, skips the calibration when set
+PASSWORD_HASH_ITERATIONS = int(os.environ.get('PASSWORD_HASH_ITERATIONS', 0))
+
+# the calibration never goes below this count
+MIN_ITERATIONS = 10000
+
+# name of the hasher used for new hashes
+DEFAULT_HASHER = os.environ.get('PASSWORD_HASHER', 'pbkdf2_sha256')
+
+try:
+    compare_digest = hmac.compare_digest
+except AttributeError:
+    def compare_digest(a, b):
+        if len(a) != len(b):
+            return False
+        result = 0
+        for x, y in zip(a, b):
+            result |= ord(x) ^ ord(y)
+        return result == 0
+
+
+def to_bytes(value):
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    return value
+
+
+def pbkdf2_sha256(password, salt, iterations):
+    """
+        Returns the PBKDF2-HMAC-SHA256 key of {password}, using the
+        C implementation of hashlib when the runtime has it.
+    """
+    if hasattr(hashlib, 'pbkdf2_hmac'):
+        return hashlib.pbkdf2_hmac('sha256', password, salt, iterations)
+    mac = hmac.new(password, digestmod=hashlib.sha256)
+
+    def prf(data):
+        h = mac.copy()
+        h.update(data)
+        return h.digest()
+    u = result = prf(salt + '\x00\x00\x00\x01')
+    result = int(result.encode('hex'), 16)
+    for _ in xrange(iterations - 1):
+        u = prf(u)
+        result ^= int(u.encode('hex'), 16)
+    return ('%064x' % result).decode('hex')
+
+
+class PBKDF2Hasher(object):
+    """
+        This is a PBKDF2Hasher Class, which makes and checks
+        pbkdf2_sha256$iterations$salt$hash hashes.
+    """
+    algorithm = 'pbkdf2_sha256'
+
+    def __init__(self):
+        self._iterations = PASSWORD_HASH_ITERATIONS or None
+
+    def iterations(self):
+        """
+            Returns the iteration count of new hashes, calibrating it
+            the first time it is needed.
+        """
+        if self._iterations is None:
+            self._iterations = self.calibrate(PASSWORD_HASH_MS)
+        return self._iterations
+
+    def calibrate(self, target_ms, sample=MIN_ITERATIONS):
+        """
+            Returns the iteration count which takes about {target_ms}
+            on this machine, measured on the best of three runs.
+        """
+        best = None
+        for _ in xrange(3):
+            started = time.time()
+            pbkdf2_sha256('calibration', 'salt' * 4, sample)
+            took = time.time() - started
+            best = took if best is None else min(best, took)
+        iterations = int(sample * target_ms / 1000.0 / max(best, 1e-6))
+        return max(MIN_ITERATIONS, iterations // 1000 * 1000)
+
+    def encode(self, name, password, salt=None, iterations=None):
+        salt = salt or base64.b64encode(os.urandom(12))
+        iterations = iterations or self.iterations()
+        key = pbkdf2_sha256(to_bytes(password), to_bytes(salt), iterations)
+        return '%s$%d$%s$%s' % (self.algorithm, iterations, salt,
+                                base64.b64encode(key))
+
+    def verify(self, name, password, encoded):
+        algorithm, iterations, salt, _ = encoded.split('$', 3)
+        return compare_digest(
+            to_bytes(encoded),
+            to_bytes(self.encode(name, password, salt, int(iterations))))
+
+    def needs_update(self, encoded):
+        """
+            Checks whether {encoded} is much cheaper than new hashes.
+            Instances calibrate to slightly different counts, so small
+            differences are let through instead of rehashing on every
+            login.
+        """
+        iterations = int(encoded.split('$', 2)[1])
+        return iterations < self.iterations() // 2
+
+
+class LegacySHA256Hasher(object):
+    """
+        This is a LegacySHA256Hasher Class, which checks the salt,hash
+        hashes of users registered before PBKDF2. It never makes new
+        hashes, and its hashes always need an update.
+    """
+    algorithm = 'sha256'
+
+    def encode(self, name, password, salt, iterations=None):
+        h = hashlib.sha256(to_bytes(name + password + salt)).hexdigest()
+        return '%s,%s' % (salt, h)
+
+    def verify(self, name, password, encoded):
+        salt = encoded.split(',')[0]
+        return compare_digest(to_bytes(encoded),
+                              to_bytes(self.encode(name, password, salt)))
+
+    def needs_update(self, encoded):
+        return True
+
+
+HASHERS = dict((hasher.algorithm, hasher)
+               for hasher in (PBKDF2Hasher(), LegacySHA256Hasher()))
+
+
+def get_hasher(algorithm=None):
+    return HASHERS[algorithm or DEFAULT_HASHER]
+
+
+def identify(encoded):
+    """
+        Returns the hasher which made {encoded}.
+    """
+    if '$' in encoded:
+        return HASHERS[encoded.split('$', 1)[0]]
+    return HASHERS['sha256']
+
+
+def make(name, password, algorithm=None):
+    return get_hasher(algorithm).encode(name, password)
+
+
+def verify(name, password, encoded):
+    try:
+        hasher = identify(encoded)
+    except KeyError:
+        return False
+    return hasher.verify(name, password, encoded)
+
+
+def needs_update(encoded):
+    """
+        Checks whether {encoded} should be made again by the default
+        hasher, at its current cost.
+    """
+    hasher = identify(encoded)
+    return hasher is not get_hasher() or hasher.needs_update(encoded)
@@ -1,7 +1,32 @@
 from google.appengine.ext import db
 
-from user import User
+from user import user_name
 import TemplateFile
+import cache
+import markup
+
+
+# words kept in the excerpt shown on the front page
+EXCERPT_WORDS = 50
+
+# most utf-8 bytes of the excerpt, well below the 1500 bytes limit of
+# indexed strings
+EXCERPT_BYTES = 1000
+
+# reading speed used for the reading time
+WORDS_PER_MINUTE = 200
+
+# properties the front page loads, the content is left out
+SUMMARY_PROPERTIES = ('user_id', 'subject', 'excerpt', 'reading_time',
+                      'created', 'last_modified')
+
+
+def blog_key(name='default'):
+    """
+        Old common parent of every post, comment and like. Entities
+        written before posts became entity group roots still live here.
+    """
+    return db.Key.from_path('blogs', name)
 
 
 # Post Model
@@ -14,25 +39,153 @@ class Post(db.Model):
             user_id (int): This is user id, who wrote the blog post.
             subject (str): This is subject line of the post.
             content (text): This is content of the post.
+            rendered_html (text): This is content rendered to html.
+            renderer_version (int): This is the markup version which
+                                    rendered {rendered_html}.
+            excerpt (str): This is the start of content, as plain text.
+            word_count (int): This is the number of words of content.
+            reading_time (int): This is the reading time in minutes.
             created (text): This is date of the post.
     """
 
     user_id = db.IntegerProperty(required=True)
     subject = db.StringProperty(required=True)
     content = db.TextProperty(required=True)
+    rendered_html = db.TextProperty()
+    renderer_version = db.IntegerProperty(default=0)
+    excerpt = db.StringProperty(multiline=True)
+    word_count = db.IntegerProperty()
+    reading_time = db.IntegerProperty()
     created = db.DateTimeProperty(auto_now_add=True)
     last_modified = db.DateTimeProperty(auto_now=True)
 
+    @classmethod
+    def by_id_async(self, post_id):
+        """
+            This method starts fetching the Post whose id is {post_id},
+            looking at its own key and at its key under blog_key() in one
+            batch get. Returns a function which waits for the Post.
+        """
+        post_id = int(post_id)
+        rpc = db.get_async([db.Key.from_path('Post', post_id),
+                            db.Key.from_path('Post', post_id,
+                                             parent=blog_key())])
+
+        def result():
+            post, legacy = rpc.get_result()
+            return post or legacy
+        return result
+
+    @classmethod
+    def by_id(self, post_id):
+        """
+            This method fetchs the Post whose id is {post_id}.
+        """
+        return self.by_id_async(post_id)()
+
+    @classmethod
+    def by_ids(self, post_ids):
+        """
+            This method fetchs the posts whose ids are {post_ids} in one
+            batch get, and returns a {post_id: Post} dict.
+        """
+        post_ids = list(set(int(post_id) for post_id in post_ids))
+        keys = []
+        for post_id in post_ids:
+            keys.append(db.Key.from_path('Post', post_id))
+            keys.append(db.Key.from_path('Post', post_id,
+                                         parent=blog_key()))
+        posts = db.get(keys) if keys else []
+        found = {}
+        for i, post_id in enumerate(post_ids):
+            post = posts[2 * i] or posts[2 * i + 1]
+            if post:
+                found[post_id] = post
+        return found
+
+    @classmethod
+    def summaries(self):
+        """
+            This method returns a query of posts, newest first, which
+            loads only the properties shown on the front page.
+        """
+        return Post.all(projection=SUMMARY_PROPERTIES).order('-created')
+
     def getUserName(self):
         """
             Gets username of the person, who wrote the blog post.
         """
-        user = User.by_id(self.user_id)
-        return user.name
+        return user_name(self)
+
+    def fragment_key(self):
+        """
+            Returns the cache key of the rendered post. It changes
+            with every edit, so stale fragments are never served.
+        """
+        return 'post-fragment:%d:%s' % (self.key().id(),
+                                        self.last_modified.isoformat())
+
+    def render_content(self):
+        """
+            Renders content to html and computes its summary, to store
+            them with the post. Called whenever content is written.
+        """
+        self.rendered_html = markup.render(self.content)
+        self.renderer_version = markup.RENDERER_VERSION
+
+        words = markup.html_text(self.rendered_html).split()
+        self.word_count = len(words)
+        self.reading_time = max(1, int(round(float(len(words)) /
+                                             WORDS_PER_MINUTE)))
+        excerpt = u' '.join(words[:EXCERPT_WORDS])
+        if len(words) > EXCERPT_WORDS:
+            excerpt += u' \u2026'
+        # cut whole characters only
+        self.excerpt = excerpt.encode('utf-8')[:EXCERPT_BYTES].decode(
+            'utf-8', 'ignore')
+
+    def content_html(self):
+        """
+            Returns the stored html of content. Posts rendered by an
+            older markup version are rendered again, but not stored.
+        """
+        if self.renderer_version == markup.RENDERER_VERSION:
+            return self.rendered_html
+        return markup.render(self.content)
 
     def render(self):
         """
             Renders the post using object data.
+            The html is cached until the post is edited or deleted.
+        """
+        key = self.fragment_key()
+        html = cache.get(key)
+        if html is None:
+            self._render_text = self.content_html()
+            html = TemplateFile.jinja_render_str("post.html", p=self)
+            cache.set(key, html)
+        return html
+
+    def render_summary(self):
+        """
+            Renders the front page summary of the post, which
+            may be a projection holding only SUMMARY_PROPERTIES.
+            Posts stored before summaries existed get theirs computed,
+            but not stored.
+        """
+        if self.excerpt is None:
+            self.render_content()
+        key = 'summary-' + self.fragment_key()
+        html = cache.get(key)
+        if html is None:
+            html = TemplateFile.jinja_render_str("post.html", p=self,
+                                                 summary=True)
+            cache.set(key, html)
+        return html
+
+    def uncache(self):
+        """
+            Drops the cached html of the post.
         """
-        self._render_text = self.content.replace('\n', '<br>')
-        return TemplateFile.jinja_render_str("post.html", p=self)
+        cache.delete(self.fragment_key())
+        cache.delete('summary-' + self.fragment_key())
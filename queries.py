@@ -0,0 +1,112 @@
+import time
+import logging
+
+from google.appengine.ext import db
+from google.appengine.ext import gql
+
+import instrument
+
+# parameterized GQL used by the handlers
+QUERIES = {
+    'comments_by_post': 'SELECT * FROM Comment WHERE post_id = :1 '
+                        'ORDER BY created DESC',
+    'likes_by_post': 'SELECT __key__ FROM Like '
+                     'WHERE ANCESTOR IS :1 AND post_id = :2',
+    'posts_by_user': 'SELECT * FROM Post WHERE user_id = :1 '
+                     'ORDER BY created DESC',
+    'post_keys_by_user': 'SELECT __key__ FROM Post WHERE user_id = :1',
+    'comments_by_user': 'SELECT * FROM Comment WHERE user_id = :1 '
+                        'ORDER BY created DESC',
+}
+
+
+def validate():
+    """
+        Parses every query, so malformed GQL fails when the instance
+        starts instead of on the request that first runs it.
+    """
+    for name, text in QUERIES.items():
+        try:
+            gql.GQL(text)
+        except Exception as e:
+            raise ValueError('Malformed GQL in query %s: %s' % (name, e))
+
+
+validate()
+
+
+def bind(name, *args):
+    """
+        Returns a new query {name} bound to {args}. Each call gets its
+        own query, since a query holds the cursor of its last run.
+    """
+    return db.GqlQuery(QUERIES[name], *args)
+
+
+def log_query(name, rpcs, seconds):
+    logging.debug('query %s: %d rpcs, %.1f ms', name, rpcs, seconds * 1000)
+
+
+class Measure(object):
+    """
+        This is a Measure Class, which adds up the datastore calls and
+        the time of the steps of one query. Each step is measured on
+        its own, so the reads a handler sends between starting a query
+        and waiting for it are not counted.
+    """
+
+    def __init__(self):
+        self.rpcs = 0
+        self.seconds = 0.0
+
+    def step(self, fn):
+        """
+            This method calls fn(), adding its datastore calls and
+            time to the measure. Returns what fn() returns.
+        """
+        started, rpcs = time.time(), instrument.rpc_count()
+        try:
+            return fn()
+        finally:
+            self.rpcs += instrument.rpc_count() - rpcs
+            self.seconds += time.time() - started
+
+
+def fetch_async(name, args, limit, cursor=None):
+    """
+        Starts fetching up to {limit} results of query {name} in one
+        batch. Returns a function which waits for the results and
+        the end cursor. The logged time is the time spent sending the
+        query and waiting for it, not the time in between.
+    """
+    measure = Measure()
+    q = bind(name, *args)
+    if cursor:
+        q.with_cursor(cursor)
+    # run() sends the first batch right away, without waiting for it
+    results = measure.step(lambda: q.run(limit=limit, batch_size=limit))
+
+    def result():
+        fetched, end_cursor = measure.step(
+            lambda: (list(results), q.cursor()))
+        log_query(name, measure.rpcs, measure.seconds)
+        return fetched, end_cursor
+    return result
+
+
+def fetch(name, args, limit, cursor=None):
+    """
+        Fetches up to {limit} results of query {name} in one batch,
+        starting at {cursor}. Returns the results and the end cursor.
+    """
+    return fetch_async(name, args, limit, cursor)()
+
+
+def count(name, args, limit=None):
+    """
+        Counts the results of query {name}, up to {limit}.
+    """
+    measure = Measure()
+    result = measure.step(lambda: bind(name, *args).count(limit))
+    log_query(name, measure.rpcs, measure.seconds)
+    return result
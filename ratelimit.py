@@ -0,0 +1,102 @@
+import os
+import time
+import logging
+import threading
+
+from google.appengine.api import memcache
+
+import cache
+import instrument
+
+# when '0', no request is limited
+ENABLED = os.environ.get('RATE_LIMIT', '1') != '0'
+
+# (route, method) -> (requests, seconds): each user, or each ip address
+# for anonymous clients, may burst up to {requests} requests, refilled
+# evenly over {seconds}
+LIMITS = {
+    ('/blog/newpost', 'POST'): (5, 60),
+    ('/blog/([0-9]+)', 'POST'): (20, 60),
+    ('/signup', 'POST'): (5, 3600),
+    ('/login', 'POST'): (10, 60),
+}
+
+# compare-and-set attempts before memcache is given up for the local store
+CAS_RETRIES = 3
+
+# buckets of this instance, used whenever memcache is unavailable
+local = cache.LRUCache(max_size=10000)
+_local_lock = threading.Lock()
+
+
+def refill(bucket, capacity, per, now):
+    """
+        Takes one token from {bucket}, a (tokens, time) pair or None for
+        a full bucket, after adding the tokens earned since its time.
+        Returns the new bucket and the seconds to wait, 0 if the token
+        was taken.
+    """
+    rate = float(capacity) / per
+    tokens, updated = bucket or (capacity, now)
+    tokens = min(capacity, tokens + (now - updated) * rate)
+    if tokens >= 1:
+        return (tokens - 1, now), 0
+    return (tokens, now), (1 - tokens) / rate
+
+
+def take_shared(key, capacity, per, now):
+    """
+        Takes a token from the bucket {key} in memcache, with
+        compare-and-set so concurrent requests never share a token.
+        Returns the seconds to wait, or None if memcache failed.
+    """
+    client = memcache.Client()
+    try:
+        for _ in xrange(CAS_RETRIES):
+            bucket = client.gets(key)
+            new, wait = refill(bucket, capacity, per, now)
+            if bucket is None:
+                stored = client.add(key, new, time=per)
+            else:
+                stored = client.cas(key, new, time=per)
+            if stored:
+                return wait
+    except Exception:
+        logging.warning('memcache rate limit failed for %s', key,
+                        exc_info=True)
+    return None
+
+
+def take_local(key, capacity, per, now):
+    with _local_lock:
+        new, wait = refill(local.get(key), capacity, per, now)
+        local.set(key, new, ttl=per)
+    return wait
+
+
+def take(key, capacity, per):
+    """
+        Takes a token from the bucket {key}, holding {capacity} tokens
+        refilled over {per} seconds. Returns the seconds to wait before
+        trying again, 0 if the request may go on.
+    """
+    now = time.time()
+    wait = take_shared(key, capacity, per, now)
+    if wait is None:
+        wait = take_local(key, capacity, per, now)
+    return wait
+
+
+def check(route, method, client):
+    """
+        Checks the limit of {route} and {method} for {client}, a user id
+        or an ip address. Returns the seconds to wait, 0 if the request
+        is allowed or has no limit.
+    """
+    limit = LIMITS.get((route, method))
+    if not ENABLED or not limit:
+        return 0
+    wait = take('ratelimit:%s:%s:%s' % (method, route, client), *limit)
+    if wait:
+        instrument.add('rate_limited')
+    return wait
@@ -0,0 +1,349 @@
+import re
+import math
+import json
+import logging
+
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+from post import Post
+from comment import Comment
+
+# task queue which applies index updates one at a time, see queue.yaml
+QUEUE = 'search'
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+# number of characters of a document kept for the result snippet
+SNIPPET_LENGTH = 200
+
+# most postings of a term read by a query, the ones of highest impact
+MAX_POSTINGS = 1000
+
+# most entities written or deleted in one call
+WRITE_BATCH = 500
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# longer tokens, like pasted hashes, are not indexed: terms are part of
+# posting key names, which have a size limit
+MAX_TOKEN_LENGTH = 64
+
+STOP_WORDS = frozenset('''a an and are as at be but by for if in into is it
+no not of on or such that the their then there these they this to was will
+with'''.split())
+
+
+def tokenize(text):
+    """
+        Splits {text} into lowercase terms, without stop words.
+    """
+    return [token for token in TOKEN_RE.findall((text or '').lower())
+            if 1 < len(token) <= MAX_TOKEN_LENGTH and
+            token not in STOP_WORDS]
+
+
+# SearchTerm Model
+class SearchTerm(db.Model):
+    """
+        This is a SearchTerm Class, which counts the documents holding
+        a term, for its weight. The key name is the term.
+
+        Attributes:
+            doc_count (int): This is the number of documents holding it.
+    """
+    doc_count = db.IntegerProperty(default=0)
+
+
+# SearchPosting Model
+class SearchPosting(db.Model):
+    """
+        This is a SearchPosting Class, one entry of the inverted index:
+        a term in a document. Each posting is its own entity, so terms
+        found in many documents do not outgrow one entity.
+        The key name is <term> <doc id>.
+
+        Attributes:
+            term (str): This is the term.
+            doc_id (str): This is the doc id of the document.
+            count (int): This is the number of times the term occurs.
+            length (int): This is the number of terms of the document.
+            impact (float): This is the BM25 term frequency weight when
+                            the posting was written, the order in which
+                            queries read postings.
+    """
+    term = db.StringProperty(required=True)
+    doc_id = db.StringProperty(required=True, indexed=False)
+    count = db.IntegerProperty(required=True, indexed=False)
+    length = db.IntegerProperty(required=True, indexed=False)
+    impact = db.FloatProperty(required=True)
+
+
+# SearchDoc Model
+class SearchDoc(db.Model):
+    """
+        This is a SearchDoc Class, which holds an indexed post or comment.
+        The key name is the doc id, post:<id> or comment:<post id>:<id>,
+        and comments are children of the SearchDoc key of their post.
+
+        Attributes:
+            post_id (int): This is the post shown for the document.
+            snippet (text): This is the start of the document text.
+            terms (text): This is a JSON {term: frequency} map.
+            length (int): This is the number of terms of the document.
+    """
+    post_id = db.IntegerProperty(required=True)
+    snippet = db.TextProperty()
+    terms = db.TextProperty(default='{}')
+    length = db.IntegerProperty(default=0)
+
+
+# SearchStats Model
+class SearchStats(db.Model):
+    """
+        This is a SearchStats Class, the totals BM25 needs.
+
+        Attributes:
+            doc_count (int): This is the number of indexed documents.
+            total_length (int): This is the sum of all document lengths.
+    """
+    doc_count = db.IntegerProperty(default=0)
+    total_length = db.IntegerProperty(default=0)
+
+
+def stats_key():
+    return db.Key.from_path('SearchStats', 'stats')
+
+
+def term_key(term):
+    return db.Key.from_path('SearchTerm', term)
+
+
+def posting_key(term, doc_id):
+    return db.Key.from_path('SearchPosting', '%s %s' % (term, doc_id))
+
+
+def doc_key(doc_id):
+    """
+        Returns the key of {doc_id}, under the key of its post for
+        comments, so the documents of a post are one ancestor query.
+    """
+    parts = doc_id.split(':')
+    if parts[0] == 'comment':
+        return db.Key.from_path('SearchDoc', 'post:%s' % parts[1],
+                                'SearchDoc', doc_id)
+    return db.Key.from_path('SearchDoc', doc_id)
+
+
+def post_doc(post):
+    """
+        Returns the (doc id, fields) pair indexing {post}.
+    """
+    return ('post:%d' % post.key().id(),
+            dict(post_id=post.key().id(),
+                 text='%s\n%s' % (post.subject, post.content)))
+
+
+def comment_doc(comment):
+    """
+        Returns the (doc id, fields) pair indexing {comment}.
+    """
+    return ('comment:%d:%d' % (comment.post_id, comment.key().id()),
+            dict(post_id=comment.post_id, text=comment.comment))
+
+
+def term_weight(count, length, average):
+    """
+        Returns the BM25 weight of a term found {count} times in a
+        document of {length} terms, before the idf.
+    """
+    norm = K1 * (1 - B + B * length / average)
+    return count * (K1 + 1) / (count + norm)
+
+
+def update(added, removed):
+    """
+        Applies index changes: {added} is a list of (doc id, fields)
+        pairs to index or index again, {removed} a list of doc ids.
+        Reads and writes every touched entity in batches.
+    """
+    doc_ids = [doc_id for doc_id, _ in added] + list(removed)
+    old_docs = dict(zip(doc_ids, db.get([doc_key(d) for d in doc_ids])))
+    stats = db.get(stats_key()) or SearchStats(key=stats_key())
+
+    new_docs = {}
+    for doc_id, fields in added:
+        counts = {}
+        for token in tokenize(fields['text']):
+            counts[token] = counts.get(token, 0) + 1
+        new_docs[doc_id] = SearchDoc(
+            key=doc_key(doc_id), post_id=fields['post_id'],
+            snippet=fields['text'][:SNIPPET_LENGTH],
+            terms=json.dumps(counts), length=sum(counts.values()))
+
+    for old in old_docs.values():
+        if old:
+            stats.doc_count -= 1
+            stats.total_length -= old.length
+    for doc in new_docs.values():
+        stats.doc_count += 1
+        stats.total_length += doc.length
+    average = float(stats.total_length) / max(1, stats.doc_count) or 1.0
+
+    # postings to write and to drop, and the change of each term's
+    # document count
+    to_put, to_delete, doc_counts = [], [], {}
+    for doc_id, old in old_docs.items():
+        new = new_docs.get(doc_id)
+        old_terms = set(json.loads(old.terms)) if old else set()
+        new_terms = json.loads(new.terms) if new else {}
+        for term in old_terms - set(new_terms):
+            to_delete.append(posting_key(term, doc_id))
+            doc_counts[term] = doc_counts.get(term, 0) - 1
+        for term, count in new_terms.items():
+            to_put.append(SearchPosting(
+                key=posting_key(term, doc_id), term=term, doc_id=doc_id,
+                count=count, length=new.length,
+                impact=term_weight(count, new.length, average)))
+            if term not in old_terms:
+                doc_counts[term] = doc_counts.get(term, 0) + 1
+
+    terms = [term for term, change in doc_counts.items() if change]
+    entities = db.get([term_key(term) for term in terms]) if terms else []
+    for term, entity in zip(terms, entities):
+        entity = entity or SearchTerm(key=term_key(term))
+        entity.doc_count += doc_counts[term]
+        if entity.doc_count > 0:
+            to_put.append(entity)
+        else:
+            to_delete.append(entity.key())
+
+    to_put.extend(new_docs.values())
+    to_put.append(stats)
+    to_delete.extend(doc_key(doc_id) for doc_id in removed
+                     if old_docs.get(doc_id))
+    for i in xrange(0, len(to_put), WRITE_BATCH):
+        db.put(to_put[i:i + WRITE_BATCH])
+    for i in xrange(0, len(to_delete), WRITE_BATCH):
+        db.delete(to_delete[i:i + WRITE_BATCH])
+
+
+def index_post(post):
+    """
+        Queues the indexing of {post}.
+    """
+    deferred.defer(update, [post_doc(post)], [], _queue=QUEUE)
+
+
+def index_comment(comment):
+    """
+        Queues the indexing of {comment}.
+    """
+    deferred.defer(update, [comment_doc(comment)], [], _queue=QUEUE)
+
+
+def remove_comment(post_id, comment_id):
+    """
+        Queues the removal of comment {comment_id} of post {post_id}
+        from the index.
+    """
+    deferred.defer(update, [],
+                   ['comment:%d:%d' % (int(post_id), int(comment_id))],
+                   _queue=QUEUE)
+
+
+def remove_post(post_id):
+    """
+        Queues the removal of post {post_id} and its comments.
+    """
+    deferred.defer(remove_post_task, int(post_id), _queue=QUEUE)
+
+
+def remove_post_task(post_id):
+    """
+        Removes post {post_id} and its comments, read with an ancestor
+        query, so comments indexed just before are removed too.
+    """
+    keys = SearchDoc.all(keys_only=True).ancestor(
+        doc_key('post:%d' % post_id))
+    update([], [key.name() for key in keys])
+
+
+def search(query, offset=0, limit=10):
+    """
+        Ranks the documents matching {query} with BM25, reading the
+        MAX_POSTINGS postings of highest impact of each term, so
+        common terms cost no more than rare ones. Returns the number
+        of matches found and the SearchDocs of the requested page,
+        each with its score in {score}.
+    """
+    terms = list(set(tokenize(query)))
+    if not terms:
+        return 0, []
+    entities = db.get([term_key(term) for term in terms] + [stats_key()])
+    stats = entities.pop()
+    if not stats or not stats.doc_count:
+        return 0, []
+
+    average = float(stats.total_length) / stats.doc_count
+
+    # the postings of every term are read at once, and carry the
+    # document length, so only the docs of the requested page are read
+    found = [(entity, SearchPosting.all().filter('term =', term)
+              .order('-impact').run(limit=MAX_POSTINGS,
+                                    batch_size=MAX_POSTINGS))
+             for term, entity in zip(terms, entities) if entity]
+    scores = {}
+    for entity, postings in found:
+        idf = math.log(1 + (stats.doc_count - entity.doc_count + 0.5) /
+                       (entity.doc_count + 0.5))
+        for posting in postings:
+            scores[posting.doc_id] = scores.get(posting.doc_id, 0) + \
+                idf * term_weight(posting.count, posting.length, average)
+
+    ranked = sorted(scores, key=scores.get, reverse=True)
+    page_ids = ranked[offset:offset + limit]
+    page = []
+    for doc_id, doc in zip(page_ids, db.get([doc_key(d) for d in page_ids])):
+        if doc:
+            doc.score = scores[doc_id]
+            page.append(doc)
+    return len(ranked), page
+
+
+def rebuild(kind='Post', cursor=None, batch_size=100):
+    """
+        Task that indexes every post, then every comment, one batch
+        per task. Start it with clear() to drop the old index first.
+    """
+    model = Post if kind == 'Post' else Comment
+    query = model.all()
+    if cursor:
+        query.with_cursor(cursor)
+    entities = query.fetch(batch_size)
+
+    make_doc = post_doc if model is Post else comment_doc
+    update([make_doc(entity) for entity in entities], [])
+
+    if len(entities) == batch_size:
+        deferred.defer(rebuild, kind, query.cursor(), batch_size,
+                       _queue=QUEUE)
+    elif kind == 'Post':
+        deferred.defer(rebuild, 'Comment', _queue=QUEUE)
+    else:
+        logging.info('Search index rebuilt')
+
+
+def clear(batch_size=500):
+    """
+        Task that deletes the whole index, then starts rebuild().
+    """
+    for model in (SearchTerm, SearchPosting, SearchDoc, SearchStats):
+        keys = model.all(keys_only=True).fetch(batch_size)
+        if keys:
+            db.delete(keys)
+            deferred.defer(clear, batch_size, _queue=QUEUE)
+            return
+    deferred.defer(rebuild, _queue=QUEUE)
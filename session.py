@@ -0,0 +1,103 @@
+import hmac
+
+from google.appengine.ext import db
+
+from user import User
+import hash_secret
+import cache
+
+# import secret for hashing fom hash_secret.py
+secret = hash_secret.secret()
+
+# seconds a logged in user is kept in the session caches
+USER_TTL = 60
+
+# cookie value -> user id, for cookies whose signature was checked
+verified_cookies = cache.LRUCache(max_size=2000)
+
+# user id -> User, per instance
+users = cache.LRUCache(max_size=500, ttl=USER_TTL)
+
+# where users were found when they were not in the instance cache
+loads = {'memcache': 0, 'datastore': 0}
+
+
+def make_secure_val(val):
+    """
+        Creates secure value using secret.
+    """
+    return '%s|%s' % (val, hmac.new(secret, val).hexdigest())
+
+
+def check_secure_val(secure_val):
+    """
+        Verifies secure value compare secret.
+    """
+    val = secure_val.split('|')[0]
+    if secure_val == make_secure_val(val):
+        return val
+
+
+def verify(cookie_val):
+    """
+        Returns the value of a signed cookie, checking the signature
+        only the first time the instance sees the cookie.
+    """
+    if not cookie_val:
+        return None
+    val = verified_cookies.get(cookie_val)
+    if val is None:
+        val = check_secure_val(cookie_val)
+        if val:
+            verified_cookies.set(cookie_val, val)
+    return val
+
+
+def user_key(uid):
+    return 'session-user:%d' % uid
+
+
+def get_user(uid):
+    """
+        Returns the User {uid}, looking in the instance cache,
+        then in memcache, then in the datastore.
+    """
+    uid = int(uid)
+    u = users.get(uid)
+    if u:
+        return u
+
+    data = cache.get(user_key(uid))
+    if data:
+        u = db.model_from_protobuf(data)
+        loads['memcache'] += 1
+    else:
+        u = User.by_id(uid)
+        loads['datastore'] += 1
+        if u:
+            cache.set(user_key(uid), db.model_to_protobuf(u).Encode(),
+                      time=USER_TTL)
+    if u:
+        users.set(uid, u)
+    return u
+
+
+def forget_user(uid):
+    """
+        Drops User {uid} from the session caches, after it changed.
+    """
+    uid = int(uid)
+    users.delete(uid)
+    cache.delete(user_key(uid))
+
+
+def stats():
+    """
+        Returns the session cache counters and the instance hit rate.
+    """
+    result = users.stats()
+    lookups = result['hits'] + result['misses']
+    result['hit_rate'] = lookups and float(result['hits']) / lookups
+    result['loads'] = dict(loads)
+    result['verified_cookies'] = verified_cookies.stats()
+    return result
@@ -0,0 +1,90 @@
+"""
+    Base class of the tests, which run the app against the App Engine
+    stubs. They need the SDK and WebTest, and are skipped without them:
+
+        $ GAE_SDK=~/google-cloud-sdk/platform/google_appengine \\
+              python -m unittest discover tests
+"""
+import os
+import sys
+import unittest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SDK = os.environ.get('GAE_SDK')
+
+
+def setup_sdk():
+    """
+        Puts the App Engine SDK and the app on sys.path, once.
+    """
+    if ROOT in sys.path:
+        return
+    sys.path.insert(0, SDK)
+    import dev_appserver
+    dev_appserver.fix_sys_path()
+    sys.path.insert(0, ROOT)
+    # read templates from disk, like the dev server
+    os.environ.setdefault('SERVER_SOFTWARE', 'Development/tests')
+    # skip the password hash calibration, registering users stays fast
+    os.environ.setdefault('PASSWORD_HASH_ITERATIONS', '10000')
+
+
+class BlogTestCase(unittest.TestCase):
+    """
+        This is a BlogTestCase Class, which activates fresh datastore,
+        memcache and task queue stubs for every test. Queries must have
+        their composite index in index.yaml.
+    """
+
+    def setUp(self):
+        if not SDK or sys.version_info[0] > 2:
+            self.skipTest('needs python 2.7 and GAE_SDK')
+        setup_sdk()
+        from google.appengine.datastore import datastore_stub_util
+        from google.appengine.ext import testbed
+
+        self.testbed = testbed.Testbed()
+        self.testbed.activate()
+        policy = datastore_stub_util.PseudoRandomHRConsistencyPolicy(
+            probability=1)
+        self.testbed.init_datastore_v3_stub(consistency_policy=policy,
+                                            require_indexes=True,
+                                            root_path=ROOT)
+        self.testbed.init_memcache_stub()
+        self.testbed.init_taskqueue_stub(root_path=ROOT)
+        self.testbed.init_user_stub()
+
+        import instrument
+        # the testbed made a new api proxy, without the hooks
+        instrument.install_hooks()
+        self.clear_local_caches()
+
+    def tearDown(self):
+        self.testbed.deactivate()
+
+    def app(self):
+        import webtest
+        import blog
+        return webtest.TestApp(blog.app)
+
+    def cookie(self, user_id):
+        from session import make_secure_val
+        return {'Cookie': 'user_id=%s' % make_secure_val(str(user_id))}
+
+    def clear_local_caches(self):
+        import cache
+        import ratelimit
+        import session
+        for local in (cache.local, ratelimit.local, session.users,
+                      session.verified_cookies):
+            local.clear()
+
+    def flush_caches(self):
+        """
+            Empties memcache and the local caches, so the next request
+            reads everything from the datastore.
+        """
+        from google.appengine.api import memcache
+        memcache.flush_all()
+        self.clear_local_caches()
@@ -0,0 +1,106 @@
+"""
+    Every query of queries.QUERIES runs against the datastore stub with
+    indexes required, and returns what its handlers expect.
+"""
+from tests.base import BlogTestCase
+
+
+class QueriesTest(BlogTestCase):
+
+    def setUp(self):
+        super(QueriesTest, self).setUp()
+        import datetime
+        from google.appengine.ext import db
+        from post import Post
+        from comment import Comment
+        from like import Like
+
+        self.author, self.reader = 1, 2
+        self.post = Post(user_id=self.author, subject='Subject',
+                         content='Content')
+        self.post.put()
+        self.other = Post(user_id=self.reader, subject='Other',
+                          content='Content')
+        self.other.put()
+        started = datetime.datetime(2020, 1, 1)
+        self.comments = [
+            Comment(parent=self.post.key(), post_id=self.post.key().id(),
+                    user_id=self.reader, comment='Comment %d' % i,
+                    created=started + datetime.timedelta(minutes=i))
+            for i in range(5)]
+        db.put(self.comments)
+        self.like = Like(key=Like.make_key(self.post.key(), self.reader),
+                         user_id=self.reader, post_id=self.post.key().id())
+        self.like.put()
+
+    def fetch(self, name, args, limit=100):
+        import queries
+        return queries.fetch(name, args, limit)[0]
+
+    def test_every_query_is_tested(self):
+        import queries
+        tested = set(name[len('test_'):] for name in dir(self)
+                     if name.startswith('test_'))
+        self.assertEqual(set(queries.QUERIES) - tested, set())
+
+    def test_comments_by_post(self):
+        comments = self.fetch('comments_by_post', [self.post.key().id()])
+        self.assertEqual([c.key() for c in comments],
+                         [c.key() for c in reversed(self.comments)])
+
+    def test_likes_by_post(self):
+        keys = self.fetch('likes_by_post', [self.post.key(),
+                                            self.post.key().id()])
+        self.assertEqual(keys, [self.like.key()])
+
+    def test_posts_by_user(self):
+        posts = self.fetch('posts_by_user', [self.author])
+        self.assertEqual([p.key() for p in posts], [self.post.key()])
+
+    def test_post_keys_by_user(self):
+        keys = self.fetch('post_keys_by_user', [self.reader])
+        self.assertEqual(keys, [self.other.key()])
+
+    def test_comments_by_user(self):
+        comments = self.fetch('comments_by_user', [self.reader])
+        self.assertEqual(len(comments), len(self.comments))
+        self.assertEqual(self.fetch('comments_by_user', [self.author]), [])
+
+    def test_cursors_of_concurrent_fetches(self):
+        import queries
+        post_id = self.post.key().id()
+        first = queries.fetch_async('comments_by_post', [post_id], 2)
+        second = queries.fetch_async('comments_by_post', [post_id], 4)
+        first_page, first_cursor = first()
+        second()
+        rest, _ = queries.fetch('comments_by_post', [post_id], 10,
+                                first_cursor)
+        self.assertEqual([c.key() for c in first_page + rest],
+                         [c.key() for c in reversed(self.comments)])
+
+    def test_logged_rpcs_of_fetch_async(self):
+        import queries
+        from google.appengine.ext import db
+        logged = []
+        log_query = queries.log_query
+        queries.log_query = lambda name, rpcs, seconds: logged.append(rpcs)
+        try:
+            queries.fetch('comments_by_post', [self.post.key().id()], 10)
+            alone = logged.pop()
+            pending = queries.fetch_async('comments_by_post',
+                                          [self.post.key().id()], 10)
+            # reads of the handler while the query runs
+            db.get([self.post.key(), self.other.key()])
+            db.get(self.like.key())
+            pending()
+        finally:
+            queries.log_query = log_query
+        self.assertEqual(logged, [alone])
+
+    def test_malformed_query(self):
+        import queries
+        queries.QUERIES['malformed'] = 'SELECT * FROM Post WHERE'
+        try:
+            self.assertRaises(ValueError, queries.validate)
+        finally:
+            del queries.QUERIES['malformed']
@@ -0,0 +1,59 @@
+"""
+    The datastore calls of the front page and the post page stay the
+    same whatever the number of distinct authors they show, since the
+    author names are resolved with one batch get.
+"""
+from tests.base import BlogTestCase
+
+
+class RpcCountTest(BlogTestCase):
+
+    def setUp(self):
+        super(RpcCountTest, self).setUp()
+        from user import User
+        self.user_ids = [User.register('author%d' % i, 'password')
+                         .key().id() for i in range(10)]
+        self.client = self.app()
+
+    def add_posts(self, authors):
+        from post import Post
+        posts = []
+        for i, uid in enumerate(authors):
+            post = Post(user_id=uid, subject='Post %d' % i,
+                        content='Some words for post %d.' % i)
+            post.render_content()
+            post.put()
+            posts.append(post)
+        return posts
+
+    def add_comments(self, post, authors):
+        from comment import Comment
+        for i, uid in enumerate(authors):
+            Comment(parent=post.key(), post_id=post.key().id(),
+                    user_id=uid, comment='Comment %d' % i).put()
+
+    def rpcs(self, url):
+        """
+            Returns the datastore calls of a signed in request to {url},
+            with every cache empty. Signed in requests skip the page
+            cache.
+        """
+        import instrument
+        self.flush_caches()
+        self.client.get(url, headers=self.cookie(self.user_ids[0]))
+        return instrument.rpc_count()
+
+    def test_front_page(self):
+        from blog import PAGE_SIZE
+        self.add_posts([self.user_ids[0]] * PAGE_SIZE)
+        one_author = self.rpcs('/')
+        # newer posts, each by another user, fill the first page
+        self.add_posts(self.user_ids[:PAGE_SIZE])
+        self.assertEqual(self.rpcs('/'), one_author)
+
+    def test_post_page(self):
+        single, many = self.add_posts(self.user_ids[:2])
+        self.add_comments(single, [self.user_ids[0]] * 10)
+        self.add_comments(many, self.user_ids)
+        self.assertEqual(self.rpcs('/blog/%d' % many.key().id()),
+                         self.rpcs('/blog/%d' % single.key().id()))
@@ -1,31 +1,79 @@
-import random
-import hashlib
+import logging
 
-from string import letters
 from google.appengine.ext import db
+from google.appengine.ext import deferred
 
+import cache
+import passwords
 
-# Helper functions create 5 letters salt
-def make_salt(length=5):
-    return ''.join(random.choice(letters) for x in xrange(length))
+# seconds an unknown username is remembered as missing
+MISSING_NAME_TTL = 60
 
-# implement hashing
-def make_pw_hash(name, pw, salt=None):
-    if not salt:
-        salt = make_salt()
-    h = hashlib.sha256(name + pw + salt).hexdigest()
-    return '%s,%s' % (salt, h)
+
+# implement hashing, see passwords.py
+def make_pw_hash(name, pw, algorithm=None):
+    return passwords.make(name, pw, algorithm)
 
 # compare password
 def valid_pw(name, password, h):
-    salt = h.split(',')[0]
-    return h == make_pw_hash(name, password, salt)
+    return passwords.verify(name, password, h)
 
 
 def users_key(group='default'):
     return db.Key.from_path('users', group)
 
 
+def username_key(name):
+    return db.Key.from_path('UserName', name, parent=users_key())
+
+
+def missing_name_key(name):
+    return 'username-missing:%s' % name
+
+
+# set once this instance has seen the UserNameIndex marker
+_names_indexed = {'done': False}
+
+
+# UserName Model
+class UserName(db.Model):
+    """
+        This is a UserName Class, a unique index entity keyed by
+        username, which turns name lookups into key gets.
+
+        Attributes:
+            user_id (int): This is id of the user owning the name.
+    """
+    user_id = db.IntegerProperty(required=True)
+
+
+# UserNameIndex Model
+class UserNameIndex(db.Model):
+    """
+        This is a UserNameIndex Class, a single entity written once
+        index_names() has indexed every user. Until it exists, names
+        missing from the index are also looked up with a query.
+
+        Attributes:
+            finished (datetime): This is when the index was complete.
+    """
+    finished = db.DateTimeProperty(auto_now_add=True)
+
+
+def name_index_key():
+    return db.Key.from_path('UserNameIndex', 'complete', parent=users_key())
+
+
+def names_indexed():
+    """
+        Checks whether every user has a UserName entry, reading the
+        marker only until this instance has seen it once.
+    """
+    if not _names_indexed['done']:
+        _names_indexed['done'] = bool(db.get(name_index_key()))
+    return _names_indexed['done']
+
+
 # User Model
 class User(db.Model):
     """
@@ -48,31 +96,124 @@ class User(db.Model):
         """
         return User.get_by_id(uid, parent=users_key())
 
+    @classmethod
+    def names_by_ids(self, uids):
+        """
+            This method fetchs the names of all users in {uids}
+            with one batch get, and returns a {uid: name} dict.
+        """
+        uids = list(set(uids))
+        keys = [db.Key.from_path('User', uid, parent=users_key())
+                for uid in uids]
+        users = db.get(keys) if keys else []
+        return dict((uid, u.name) for uid, u in zip(uids, users) if u)
+
     @classmethod
     def by_name(self, name):
         """
-            This method fetchs List of User objects from database,
-            whose name is {name}.
+            This method fetchs the User object from database,
+            whose name is {name}, through the UserName index.
         """
-        u = User.all().filter('name =', name).get()
+        if not name or cache.get(missing_name_key(name)):
+            return None
+
+        index = db.get(username_key(name))
+        if index:
+            return User.by_id(index.user_id)
+
+        # users registered before the index existed, until index_names()
+        # has indexed them all
+        u = None
+        if not names_indexed():
+            u = User.all().filter('name =', name).get()
+        if u:
+            UserName(key=username_key(name), user_id=u.key().id()).put()
+        else:
+            cache.set(missing_name_key(name), True, time=MISSING_NAME_TTL)
         return u
 
     @classmethod
     def register(self, name, pw, email=None):
         """
-            This method creates a new User in database.
+            This method creates a new User in database, together with
+            its UserName index entry, in one transaction.
+            Returns None if the name is already taken.
         """
         pw_hash = make_pw_hash(name, pw)
-        return User(parent=users_key(),
-                    name=name,
-                    pw_hash=pw_hash,
-                    email=email)
+        uid = db.allocate_ids(db.Key.from_path('User', 1,
+                                               parent=users_key()), 1)[0]
+
+        def txn():
+            if db.get(username_key(name)):
+                return None
+            u = User(key=db.Key.from_path('User', uid, parent=users_key()),
+                     name=name,
+                     pw_hash=pw_hash,
+                     email=email)
+            db.put([u, UserName(key=username_key(name), user_id=uid)])
+            return u
+
+        u = db.run_in_transaction(txn)
+        cache.delete(missing_name_key(name))
+        return u
 
     @classmethod
     def login(self, name, pw):
         """
-            This method creates a new User in database.
+            This method returns the User {name} if {pw} is its password.
+            A hash made by an older hasher or at a lower cost is made
+            again with the current one, and {_rehashed} is set on the
+            returned User.
         """
         u = self.by_name(name)
         if u and valid_pw(name, pw, u.pw_hash):
+            if passwords.needs_update(u.pw_hash):
+                u.pw_hash = make_pw_hash(name, pw)
+                u.put()
+                u._rehashed = True
             return u
+
+
+def index_names(cursor=None, batch_size=100):
+    """
+        Task that writes the UserName index entries of existing users,
+        one batch per task.
+    """
+    query = User.all()
+    if cursor:
+        query.with_cursor(cursor)
+    users = query.fetch(batch_size)
+    db.put([UserName(key=username_key(u.name), user_id=u.key().id())
+            for u in users])
+    for u in users:
+        cache.delete(missing_name_key(u.name))
+    if len(users) == batch_size:
+        deferred.defer(index_names, query.cursor(), batch_size)
+    else:
+        UserNameIndex(key=name_index_key()).put()
+        logging.info('UserName index migration finished')
+
+
+def prefetch_names(entities):
+    """
+        Resolves the authors of {entities} (posts, comments or likes)
+        in a single batch get, so getUserName() costs no datastore call.
+        Returns the {user_id: name} map for use in templates.
+    """
+    entities = list(entities)
+    names = User.names_by_ids(e.user_id for e in entities)
+    for e in entities:
+        e._user_name = names.get(e.user_id)
+    return names
+
+
+def user_name(entity):
+    """
+        Returns the author name of {entity}, using the prefetched name
+        when prefetch_names() has already resolved it.
+    """
+    name = getattr(entity, '_user_name', None)
+    if name is None:
+        user = User.by_id(entity.user_id)
+        name = user and user.name
+    return name
@@ -0,0 +1,300 @@
+"""
+    Write-behind ingestion of likes and comments.
+
+    Handlers record a like or comment as an event in the {QUEUE} pull
+    queue and answer at once. A drain task, scheduled at most once per
+    DRAIN_INTERVAL, leases the queued events and writes them in batches:
+    the comments in one db.put, the likes of each post with its counter
+    in one transaction. Events carry the keys of the entities they make,
+    so draining an event twice writes nothing new.
+
+    Until its events are drained, a user sees their own pending likes
+    and comments, kept in the cache by pending().
+"""
+import os
+import json
+import time
+import logging
+import datetime
+
+from google.appengine.api import taskqueue
+from google.appengine.ext import db
+from google.appengine.ext import deferred
+
+from comment import Comment
+from like import Like
+from post import Post
+import activity
+import counter
+import search
+import cache
+
+# pull queue holding the events, see queue.yaml
+QUEUE = 'writes'
+
+# when '0', events are written by the request which makes them
+WRITE_BEHIND = os.environ.get('WRITE_BEHIND', '1') != '0'
+
+# seconds between two drains, events of a burst wait at most this long
+DRAIN_INTERVAL = 2
+
+# most events leased by one drain task
+DRAIN_BATCH = 500
+
+# seconds a drain task holds its events before they are leased again
+LEASE_SECONDS = 60
+
+# most users looked up in one IN query
+IN_LIMIT = 30
+
+# seconds a user's pending writes are remembered
+PENDING_TTL = 600
+
+# last drain slot scheduled by this instance
+_scheduled = {'slot': None}
+
+
+def like_event(post, user_id):
+    return {'kind': 'like', 'post_id': post.key().id(),
+            'author_id': post.user_id,
+            'user_id': int(user_id), 'time': time.time(),
+            'key': str(Like.make_key(post.key(), user_id))}
+
+
+def comment_event(post, user_id, text):
+    """
+        Returns the event of a new comment, with a reserved id,
+        so the comment is linked to before it is written.
+    """
+    start, _ = db.allocate_ids(
+        db.Key.from_path('Comment', 1, parent=post.key()), 1)
+    return {'kind': 'comment', 'post_id': post.key().id(),
+            'user_id': int(user_id), 'comment': text, 'time': time.time(),
+            'key': str(db.Key.from_path('Comment', start,
+                                        parent=post.key()))}
+
+
+def to_entity(event):
+    """
+        Returns the unsaved Like or Comment of {event}.
+    """
+    if event['kind'] == 'like':
+        return Like(key=db.Key(event['key']), user_id=event['user_id'],
+                    post_id=event['post_id'])
+    created = datetime.datetime.utcfromtimestamp(event['time'])
+    return Comment(key=db.Key(event['key']), user_id=event['user_id'],
+                   post_id=event['post_id'], comment=event['comment'],
+                   created=created)
+
+
+def pending_key(user_id, post_id):
+    return 'pending-writes:%d:%d' % (int(user_id), int(post_id))
+
+
+def submit(event):
+    """
+        Queues {event} and remembers it as pending for its user, or
+        writes it right away when WRITE_BEHIND is off.
+    """
+    if not WRITE_BEHIND:
+        return apply([event])
+    taskqueue.Queue(QUEUE).add(taskqueue.Task(payload=json.dumps(event),
+                                              method='PULL'))
+    key = pending_key(event['user_id'], event['post_id'])
+    cache.set(key, (cache.get(key) or []) + [event], time=PENDING_TTL)
+    schedule_drain()
+
+
+def pending(user_id, post):
+    """
+        Returns the unsaved entities of the likes and comments of user
+        {user_id} on {post} which are still waiting in the queue.
+    """
+    events = cache.get(pending_key(user_id, post.key().id()))
+    if not events:
+        return []
+    events = [rekey(event, post.key()) for event in events]
+    stored = db.get([db.Key(event['key']) for event in events])
+    entities = [to_entity(event) for event, entity in zip(events, stored)
+                if not entity]
+    for entity in entities:
+        entity._pending = True
+    return entities
+
+
+def schedule_drain():
+    """
+        Starts a drain task for the current slot of DRAIN_INTERVAL
+        seconds. The task name makes the other requests of the slot
+        share it.
+    """
+    slot = int(time.time() / DRAIN_INTERVAL)
+    if _scheduled['slot'] == slot:
+        return
+    try:
+        deferred.defer(drain, _name='drain-writes-%d' % slot,
+                       _countdown=DRAIN_INTERVAL)
+    except (taskqueue.TaskAlreadyExistsError, taskqueue.TombstonedTaskError):
+        pass
+    _scheduled['slot'] = slot
+
+
+def drain():
+    """
+        Task that writes a batch of queued events, then starts another
+        drain if the queue may hold more. Returns the number of events.
+        The events are deleted only once written. When writing fails,
+        they stay leased, so a retry of this task would find nothing:
+        a new drain starts after the lease instead.
+    """
+    queue = taskqueue.Queue(QUEUE)
+    tasks = queue.lease_tasks(LEASE_SECONDS, DRAIN_BATCH)
+    if not tasks:
+        return 0
+    try:
+        apply([json.loads(task.payload) for task in tasks])
+    except Exception:
+        logging.exception('Writing %d queued writes failed, trying again '
+                          'in %d s', len(tasks), LEASE_SECONDS)
+        deferred.defer(drain, _countdown=LEASE_SECONDS + DRAIN_INTERVAL)
+        raise deferred.PermanentTaskFailure()
+    queue.delete_tasks(tasks)
+    logging.info('Drained %d queued writes', len(tasks))
+    if len(tasks) == DRAIN_BATCH:
+        deferred.defer(drain)
+    return len(tasks)
+
+
+def post_key(event):
+    return db.Key(event['key']).parent()
+
+
+def rekey(event, current):
+    """
+        Returns {event} with its key under {current}, the key of its post
+        now. Events queued before the post was migrated out of blog_key()
+        still carry the old parent. Comments keep their id.
+    """
+    key = db.Key(event['key'])
+    if key.parent() == current:
+        return event
+    event = dict(event)
+    if event['kind'] == 'like':
+        event['key'] = str(Like.make_key(current, event['user_id']))
+    else:
+        event['key'] = str(db.Key.from_path('Comment', key.id(),
+                                            parent=current))
+    return event
+
+
+def current_events(events):
+    """
+        Returns {events} keyed under the current key of their post,
+        without the ones of deleted posts. The ids of moved comments are
+        reserved under their new parent.
+    """
+    posts = Post.by_ids(event['post_id'] for event in events)
+    current = []
+    for event in events:
+        post = posts.get(event['post_id'])
+        if not post:
+            logging.warning('Dropping a queued %s of deleted post %d',
+                            event['kind'], event['post_id'])
+            continue
+        moved = rekey(event, post.key())
+        if moved is not event and moved['kind'] == 'comment':
+            key = db.Key(moved['key'])
+            if db.allocate_id_range(key, key.id(), key.id()) == \
+                    db.KEY_RANGE_COLLISION:
+                logging.warning('Comment id %d is taken under %s',
+                                key.id(), post.key())
+        current.append(moved)
+    return current
+
+
+def apply(events):
+    """
+        Writes the likes and comments of {events}, skipping the ones
+        already written and the ones of deleted posts.
+    """
+    events = current_events(events)
+
+    comments = [event for event in events if event['kind'] == 'comment']
+    if comments:
+        apply_comments(comments)
+    likes = {}
+    for event in events:
+        if event['kind'] == 'like':
+            likes.setdefault(event['post_id'], {})[event['key']] = event
+    for post_id, post_likes in likes.items():
+        apply_likes(post_id, post_likes.values())
+
+
+def apply_comments(events):
+    stored = db.get([db.Key(event['key']) for event in events])
+    new = [to_entity(event) for event, entity in zip(events, stored)
+           if not entity]
+    if not new:
+        return
+
+    # the totals are counted before the comments are written, and
+    # named after the first comment: a retry after a failed put finds
+    # the same new comments and the same names, and counts nothing twice
+    authors = {}
+    for c in new:
+        authors.setdefault(c.user_id, []).append(c.key())
+    for user_id, keys in authors.items():
+        activity.add(user_id, comments=len(keys), op='comments:%s' % keys[0])
+    db.put(new)
+
+    for post_id in set(c.post_id for c in new):
+        cache.invalidate_page('/blog/%d' % post_id)
+    deferred.defer(search.update, [search.comment_doc(c) for c in new], [],
+                   _queue=search.QUEUE)
+
+
+def apply_likes(post_id, events):
+    """
+        Writes the new likes of post {post_id} and adds them to its
+        counter in one transaction.
+    """
+    likers = legacy_likers(post_id, events)
+    events = [event for event in events if event['user_id'] not in likers]
+    if not events:
+        return
+
+    def txn():
+        stored = db.get([db.Key(event['key']) for event in events])
+        new = [to_entity(event) for event, entity in zip(events, stored)
+               if not entity]
+        if new:
+            db.put(new)
+            counter.increment(post_id, len(new))
+        return [like.key() for like in new]
+    options = db.create_transaction_options(xg=True)
+    added = db.run_in_transaction_options(options, txn)
+
+    if added:
+        activity.add(events[0]['author_id'], likes=len(added),
+                     op='likes:%s' % added[0])
+        cache.invalidate_page('/blog/%d' % post_id)
+        cache.invalidate_page('/')
+
+
+def legacy_likers(post_id, events):
+    """
+        Returns the users of {events} who liked post {post_id} before
+        like keys were derived from (user_id, post_id), looked up with
+        one IN query per IN_LIMIT users. Older likes are children of
+        the post, or of blog_key() while the post is not migrated.
+    """
+    key = post_key(events[0])
+    ancestor = key.parent() or key
+    user_ids = list(set(event['user_id'] for event in events))
+    likers = set()
+    for i in xrange(0, len(user_ids), IN_LIMIT):
+        likes = Like.all().ancestor(ancestor) \
+            .filter('post_id =', post_id) \
+            .filter('user_id IN', user_ids[i:i + IN_LIMIT])
+        likers.update(like.user_id for like in likes)
+    return likers